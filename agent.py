@@ -5,20 +5,32 @@ Strands Agents HITL + AgentCore Runtime 非同期実行
 非同期実行を組み合わせて、バックグラウンド実行 + Human in the Loopを実現します。
 """
 
+import atexit
+import contextvars
+import functools
+import inspect
+import itertools
 import os
 import json
 import threading
 import uuid
 from datetime import datetime, timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Any, Optional
 
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
+from botocore.config import Config
+from cachetools import LRUCache, TTLCache
 from bedrock_agentcore.runtime.app import BedrockAgentCoreApp
 from bedrock_agentcore.runtime.context import RequestContext
 from strands import Agent, tool
 from strands.hooks import BeforeToolCallEvent, HookProvider, HookRegistry
-from strands.types.tools import ToolContext
+# 再開用の状態の保存・復元に非公開APIの _InterruptState.to_dict/from_dict と Agent._interrupt_state を使う
+# (strands-agents 1.16.0 以降。requirements.txt でバージョン範囲を固定)
+from strands.interrupt import _InterruptState
 
 # ============================================================================
 # 設定
@@ -26,139 +38,391 @@ from strands.types.tools import ToolContext
 
 DYNAMODB_TABLE_NAME = os.environ.get("HITL_TABLE_NAME", "hitl-approvals")
 AWS_REGION = os.environ.get("AWS_REGION", "ap-northeast-1")
-DANGEROUS_TOOLS = ["delete_files", "execute_command", "modify_database"]
+DANGEROUS_TOOLS = frozenset({"delete_files", "execute_command", "modify_database"})
+
+# DynamoDB接続プールの上限と、エージェントを同時に実行するワーカー数
+# （ワーカー数は接続プール以下に抑え、プールの取り合いを防ぐ）
+MAX_POOL_CONNECTIONS = 50
+MAX_WORKERS = 32
+
+# メモリ内に保持するセッション数の上限（セッション状態と読み取りキャッシュで共通）
+SESSION_CACHE_SIZE = 2048
+
+# ============================================================================
+# JSONシリアライズ
+# ============================================================================
+
+# orjson があればC実装の高速なエンコーダ/デコーダを使う（無い環境では標準ライブラリ）
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    _loads = json.loads
 
 # ============================================================================
 # DynamoDB クライアント
 # ============================================================================
 
-dynamodb = boto3.resource("dynamodb", region_name=AWS_REGION)
+# バックグラウンドスレッドから並行に書き込むため、接続プールを広げて
+# リトライとタイムアウトに上限を設ける（テーブルはモジュール全体で共有し接続を再利用）
+DYNAMODB_CONFIG = Config(
+    region_name=AWS_REGION,
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    connect_timeout=5,
+    read_timeout=10,
+    tcp_keepalive=True,
+)
+
+# 明示的なセッションを共有し、認証情報をインポート時に一度だけ解決しておく
+# （複数のバックグラウンドスレッドが同時に認証情報チェーンを解決して待たされるのを防ぐ）
+_SESSION = boto3.Session(region_name=AWS_REGION)
+_credentials = _SESSION.get_credentials()
+if _credentials is not None:
+    _credentials.get_frozen_credentials()
+
+dynamodb = _SESSION.resource("dynamodb", config=DYNAMODB_CONFIG)
 table = dynamodb.Table(DYNAMODB_TABLE_NAME)
 
 
-def save_pending_approval(session_id: str, interrupt_id: str, name: str, reason: dict):
-    """承認待ちリクエストをDynamoDBに保存"""
-    ttl = int((datetime.now() + timedelta(days=7)).timestamp())
-    item = {
-        "session_id": session_id,
-        "interrupt_id": interrupt_id,
-        "name": name,
-        "reason": json.dumps(reason, ensure_ascii=False),
-        "status": "pending",
-        "created_at": datetime.now().isoformat(),
-        "ttl": ttl,
-    }
-    table.put_item(Item=item)
-    return item
+# DynamoDBアイテムの保持期間（TTL属性）
+ITEM_RETENTION = timedelta(days=7)
+
+# __state__ 行に保存できる状態（JSON）の上限バイト数
+# DynamoDBのアイテム上限は400KBで、キーや他の属性の分を残しておく
+MAX_STATE_BYTES = 350_000
+
+
+def _item_timestamps() -> tuple[str, int]:
+    """アイテムの作成日時（ISO形式）とTTL（epoch秒）を計算"""
+    now = datetime.now()
+    return now.isoformat(), int((now + ITEM_RETENTION).timestamp())
+
+
+@dataclass(slots=True)
+class ApprovalRecord:
+    """承認待ちリクエストの行（reason はシリアライズ済みのJSON文字列）"""
+
+    session_id: str
+    interrupt_id: str
+    name: str
+    reason: str
+    created_at: str
+    ttl: int
+    status: str = "pending"
+
+    def to_item(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "interrupt_id": self.interrupt_id,
+            "name": self.name,
+            "reason": self.reason,
+            "status": self.status,
+            "created_at": self.created_at,
+            "ttl": self.ttl,
+        }
+
+
+@dataclass(slots=True)
+class StateRecord:
+    """エージェントの状態（再開用）の行（interrupt_id = "__state__"）"""
+
+    session_id: str
+    state: str
+    created_at: str
+    ttl: int
+
+    @classmethod
+    def from_state(cls, session_id: str, state: dict, *, created_at: str, ttl: int) -> "StateRecord":
+        state_json = _dumps(state)
+        state_size = len(state_json.encode())
+        if state_size > MAX_STATE_BYTES:
+            # 書き込みに失敗して再開できない承認待ちを残さないよう、承認待ちの保存前に失敗させる
+            raise ValueError(
+                f"Agent state too large to save for resume: {state_size} bytes (limit {MAX_STATE_BYTES}). "
+                "Shorten the conversation or tool results and start a new task."
+            )
+        return cls(session_id, state_json, created_at, ttl)
+
+    def to_item(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "interrupt_id": "__state__",
+            "status": "interrupted",
+            "state": self.state,
+            "created_at": self.created_at,
+            "ttl": self.ttl,
+        }
+
+
+@dataclass(slots=True)
+class ResultRecord:
+    """エージェントの実行結果の行（interrupt_id = "__result__"）"""
+
+    session_id: str
+    result: str
+    created_at: str
+    ttl: int
+
+    def to_item(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "interrupt_id": "__result__",
+            "status": "completed",
+            "result": self.result,
+            "created_at": self.created_at,
+            "ttl": self.ttl,
+        }
+
+
+def save_interrupts(session_id: str, interrupts: list, state: Optional[dict] = None):
+    """承認待ちリクエストと再開用の状態をまとめてDynamoDBに保存
+
+    BatchWriteItemで1リクエストにまとめる（25件ごとの分割と未処理アイテムの再送はbatch_writerが行う）
+    """
+    # 同じバッチのアイテムは作成日時とTTLを共有する
+    created_at, ttl = _item_timestamps()
+    items = [
+        ApprovalRecord(session_id, i.id, i.name, _dumps(i.reason), created_at, ttl).to_item()
+        for i in interrupts
+    ]
+    if state is not None:
+        items.append(StateRecord.from_state(session_id, state, created_at=created_at, ttl=ttl).to_item())
+
+    with table.batch_writer(overwrite_by_pkeys=["session_id", "interrupt_id"]) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+    if state is not None:
+        _invalidate_session_rows(session_id)
 
 
 def _convert_decimals(obj):
     """DynamoDB Decimal を JSON シリアライズ可能な型に変換"""
-    from decimal import Decimal
-    if isinstance(obj, dict):
+    # boto3 resource が返すのは素の dict/list なので type() で直接分岐する
+    obj_type = type(obj)
+    if obj_type is dict:
         return {k: _convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
+    if obj_type is list:
         return [_convert_decimals(item) for item in obj]
-    elif isinstance(obj, Decimal):
+    if obj_type is Decimal:
         return int(obj) if obj % 1 == 0 else float(obj)
     return obj
 
 
-def get_pending_approvals(session_id: Optional[str] = None):
-    """承認待ちリクエスト一覧を取得"""
+# 承認待ち一覧で返す属性（name/status は予約語のため名前プレースホルダを使う）
+PENDING_PROJECTION = "session_id, interrupt_id, #name, reason, #status, created_at"
+PENDING_PROJECTION_NAMES = {"#name": "name", "#status": "status"}
+
+
+def _query_all(**query) -> list[dict]:
+    """Queryを LastEvaluatedKey がなくなるまで繰り返し、全ページのアイテムを返す（1回の応答は最大1MB）"""
+    items = []
+    while True:
+        response = table.query(**query)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return items
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_pending_approvals(session_id: Optional[str] = None, since: Optional[str] = None):
+    """承認待ちリクエスト一覧を取得（since を指定するとその時刻以降に作成されたものだけ）
+
+    同じバッチのinterruptは同じ created_at を持つため、since は境界を含めて比較する（重複はクライアント側で除く）
+    """
     if session_id:
-        response = table.query(
-            KeyConditionExpression=Key("session_id").eq(session_id),
-            FilterExpression=Attr("status").eq("pending"),
-        )
+        # status + session_id のGSIを直接引き、承認済みの履歴を読まない
+        query = {
+            "IndexName": "status-session-index",
+            "KeyConditionExpression": Key("status").eq("pending") & Key("session_id").eq(session_id),
+        }
+        if since:
+            query["FilterExpression"] = Attr("created_at").gte(since)
     else:
-        response = table.query(
-            IndexName="status-index",
-            KeyConditionExpression=Key("status").eq("pending"),
-        )
-    items = response.get("Items", [])
+        # status-index のソートキーは created_at なので、キー条件で範囲を絞る
+        key_condition = Key("status").eq("pending")
+        if since:
+            key_condition = key_condition & Key("created_at").gte(since)
+        query = {"IndexName": "status-index", "KeyConditionExpression": key_condition}
+    items = _query_all(
+        ProjectionExpression=PENDING_PROJECTION,
+        ExpressionAttributeNames=PENDING_PROJECTION_NAMES,
+        **query,
+    )
     for item in items:
         if "reason" in item:
-            item["reason"] = json.loads(item["reason"])
+            item["reason"] = _loads(item["reason"])
     # Decimal を int/float に変換
     return _convert_decimals(items)
 
 
-def update_approval_status(session_id: str, interrupt_id: str, status: str, response: str, approver: str = "cli"):
-    """承認状態を更新"""
-    table.update_item(
-        Key={"session_id": session_id, "interrupt_id": interrupt_id},
-        UpdateExpression="SET #status = :status, #response = :response, #approver = :approver, #updated_at = :updated_at",
-        ExpressionAttributeNames={
-            "#status": "status",
-            "#response": "response",
-            "#approver": "approver",
-            "#updated_at": "updated_at",
-        },
-        ExpressionAttributeValues={
-            ":status": status,
-            ":response": response,
-            ":approver": approver,
-            ":updated_at": datetime.now().isoformat(),
-        },
-    )
+def update_approval_status(session_id: str, interrupt_id: str, status: str, response: str, approver: str = "cli") -> bool:
+    """承認状態を更新（承認待ちのものだけ。既に承認・拒否済み、または存在しない場合はFalse）"""
+    try:
+        table.update_item(
+            Key={"session_id": session_id, "interrupt_id": interrupt_id},
+            # 二重の承認・拒否で結果を上書きしたり、存在しない行を作ったりしない
+            ConditionExpression=Attr("status").eq("pending"),
+            UpdateExpression="SET #status = :status, #response = :response, #approver = :approver, #updated_at = :updated_at",
+            ExpressionAttributeNames={
+                "#status": "status",
+                "#response": "response",
+                "#approver": "approver",
+                "#updated_at": "updated_at",
+            },
+            ExpressionAttributeValues={
+                ":status": status,
+                ":response": response,
+                ":approver": approver,
+                ":updated_at": datetime.now().isoformat(),
+            },
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def get_approval_responses_bulk(session_id: str, interrupt_ids: list[str]) -> dict[str, str]:
+    """複数の承認レスポンスをまとめて取得 {interrupt_id: response}
+
+    BatchGetItemでまとめて読み込み（1リクエスト最大100キー）、未回答のものは含めない。
+    approve_and_resume では直前の承認を読むため、強い整合性で読み込む
+    """
+    responses: dict[str, str] = {}
+    keys = [{"session_id": session_id, "interrupt_id": i} for i in dict.fromkeys(interrupt_ids)]
+
+    for start in range(0, len(keys), 100):
+        request = {
+            DYNAMODB_TABLE_NAME: {
+                "Keys": keys[start:start + 100],
+                "ProjectionExpression": "interrupt_id, #status, #response",
+                "ExpressionAttributeNames": {"#status": "status", "#response": "response"},
+                "ConsistentRead": True,
+            }
+        }
+        while request:
+            result = dynamodb.batch_get_item(RequestItems=request)
+            for item in result.get("Responses", {}).get(DYNAMODB_TABLE_NAME, []):
+                if item.get("status") in ["approved", "rejected"]:
+                    responses[item["interrupt_id"]] = item.get("response")
+            request = result.get("UnprocessedKeys")
 
+    return responses
 
-def get_approval_response(session_id: str, interrupt_id: str) -> Optional[str]:
-    """承認レスポンスを取得"""
-    response = table.get_item(Key={"session_id": session_id, "interrupt_id": interrupt_id})
-    item = response.get("Item")
-    if item and item.get("status") in ["approved", "rejected"]:
-        return item.get("response")
-    return None
 
+# ============================================================================
+# 状態・結果の読み取りキャッシュ
+# ============================================================================
 
-def save_agent_result(session_id: str, result: dict):
-    """エージェントの実行結果を保存"""
-    ttl = int((datetime.now() + timedelta(days=7)).timestamp())
-    table.put_item(
-        Item={
-            "session_id": session_id,
-            "interrupt_id": "__result__",
-            "status": "completed",
-            "result": json.dumps(result, ensure_ascii=False),
-            "created_at": datetime.now().isoformat(),
-            "ttl": ttl,
+# status/result のポーリングで毎回DynamoDBを読まないよう、__state__/__result__ 行を短時間キャッシュする。
+# 同一プロセス内の書き込みで即座に無効化されるため、古い値を返しうるのは
+# 他プロセスからの書き込みに対して最大 STATE_CACHE_TTL 秒まで。
+# 読み込み中に無効化されたセッションは、世代番号を比べて読み込んだ結果をキャッシュしない。
+STATE_CACHE_TTL = 3.0
+_row_cache: TTLCache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=STATE_CACHE_TTL)
+_row_generations: TTLCache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=60)
+_row_generation_counter = itertools.count(1)
+_row_cache_lock = threading.Lock()
+
+# セッション単位の特殊行（ソートキー -> JSONを格納する属性名）
+SESSION_ROW_FIELDS = {"__state__": "state", "__result__": "result"}
+
+
+def _get_session_rows(session_id: str) -> dict[str, Optional[dict]]:
+    """__state__/__result__ 行を1回のBatchGetItemで取得 {ソートキー: 内容 or None}（TTLキャッシュ付き）"""
+    with _row_cache_lock:
+        cached = _row_cache.get(session_id)
+        generation = _row_generations.get(session_id, 0)
+    if cached is not None:
+        return cached
+
+    rows: dict[str, Optional[dict]] = dict.fromkeys(SESSION_ROW_FIELDS)
+    request = {
+        DYNAMODB_TABLE_NAME: {
+            "Keys": [{"session_id": session_id, "interrupt_id": key} for key in SESSION_ROW_FIELDS],
         }
-    )
+    }
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        for item in response.get("Responses", {}).get(DYNAMODB_TABLE_NAME, []):
+            key = item["interrupt_id"]
+            rows[key] = _loads(item.get(SESSION_ROW_FIELDS[key], "{}"))
+        request = response.get("UnprocessedKeys")
+
+    with _row_cache_lock:
+        # 読み込み中に書き込みがあった場合、書き込み前の行をキャッシュに戻さない
+        if _row_generations.get(session_id, 0) == generation:
+            _row_cache[session_id] = rows
+    return rows
+
+
+def _invalidate_session_rows(session_id: str):
+    """書き込み後にキャッシュを無効化"""
+    with _row_cache_lock:
+        _row_cache.pop(session_id, None)
+        _row_generations[session_id] = next(_row_generation_counter)
+
+
+def save_agent_result(session_id: str, result: dict, *, clear_state: bool = False):
+    """エージェントの実行結果を保存
+
+    clear_state=True の場合は再開用の __state__ 行も同じバッチで削除する
+    （メモリ内の完了・エラー状態が破棄された後に、終了済みセッションが再開されないようにするため）
+    """
+    created_at, ttl = _item_timestamps()
+    item = ResultRecord(session_id, _dumps(result), created_at, ttl).to_item()
+    if clear_state:
+        with table.batch_writer() as batch:
+            batch.put_item(Item=item)
+            batch.delete_item(Key={"session_id": session_id, "interrupt_id": "__state__"})
+    else:
+        table.put_item(Item=item)
+    _invalidate_session_rows(session_id)
 
 
 def get_agent_result(session_id: str) -> Optional[dict]:
     """エージェントの実行結果を取得"""
-    response = table.get_item(Key={"session_id": session_id, "interrupt_id": "__result__"})
-    item = response.get("Item")
-    if item:
-        return json.loads(item.get("result", "{}"))
-    return None
-
-
-def save_agent_state(session_id: str, state: dict):
-    """エージェントの状態を保存（再開用）"""
-    ttl = int((datetime.now() + timedelta(days=7)).timestamp())
-    table.put_item(
-        Item={
-            "session_id": session_id,
-            "interrupt_id": "__state__",
-            "status": "interrupted",
-            "state": json.dumps(state, ensure_ascii=False),
-            "created_at": datetime.now().isoformat(),
-            "ttl": ttl,
-        }
-    )
+    return _get_session_rows(session_id)["__result__"]
 
 
 def get_agent_state(session_id: str) -> Optional[dict]:
-    """エージェントの状態を取得（再開用）"""
-    response = table.get_item(Key={"session_id": session_id, "interrupt_id": "__state__"})
-    item = response.get("Item")
-    if item:
-        return json.loads(item.get("state", "{}"))
-    return None
+    """エージェントの状態を取得（再開用。キャッシュを通さず、強い整合性で読み込む）"""
+    item = table.get_item(
+        Key={"session_id": session_id, "interrupt_id": "__state__"},
+        ProjectionExpression="#state",
+        ExpressionAttributeNames={"#state": "state"},
+        ConsistentRead=True,
+    ).get("Item")
+    return _loads(item["state"]) if item else None
+
+
+def claim_agent_state(session_id: str) -> bool:
+    """__state__ 行を "interrupted" から "resuming" に遷移させる（既に再開済み・存在しない場合はFalse）
+
+    プロセスやVMをまたいだ同時resumeでも、承認済みの危険なツールが二重に実行されないよう
+    DynamoDBの条件付き更新で再開する権利を1回だけ取得する
+    """
+    try:
+        table.update_item(
+            Key={"session_id": session_id, "interrupt_id": "__state__"},
+            ConditionExpression=Attr("status").eq("interrupted"),
+            UpdateExpression="SET #status = :resuming",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":resuming": "resuming"},
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    finally:
+        _invalidate_session_rows(session_id)
+    return True
 
 
 # ============================================================================
@@ -169,11 +433,11 @@ def get_agent_state(session_id: str) -> Optional[dict]:
 class ApprovalHook(HookProvider):
     """危険なツール実行前に人間の承認を要求するフック"""
 
-    def __init__(self, app_name: str, session_id: str, pre_approved_tools: dict[str, str] = None):
+    def __init__(self, app_name: str, session_id: str):
         self.app_name = app_name
         self.session_id = session_id
-        # 事前承認されたツール: {tool_name: response}
-        self.pre_approved_tools = pre_approved_tools or {}
+        # ツールごとの信頼キー（approveのたびに組み立てない）
+        self._trust_keys = {t: f"{app_name}-{t}-trust" for t in DANGEROUS_TOOLS}
 
     def register_hooks(self, registry: HookRegistry, **kwargs) -> None:
         registry.add_callback(BeforeToolCallEvent, self.approve)
@@ -185,25 +449,11 @@ class ApprovalHook(HookProvider):
             return
 
         # 既に信頼済みならスキップ
-        trust_key = f"{self.app_name}-{tool_name}-trust"
+        trust_key = self._trust_keys[tool_name]
         if event.agent.state.get(trust_key) == "trusted":
             print(f"[HITL] Tool '{tool_name}' is trusted, skipping approval")
             return
 
-        # 事前承認がある場合はそれを使用（再開時）
-        if tool_name in self.pre_approved_tools:
-            approval = self.pre_approved_tools[tool_name]
-            print(f"[HITL] Using pre-approved response for tool '{tool_name}': {approval}")
-            if approval.lower() == "t":
-                event.agent.state.set(trust_key, "trusted")
-                print(f"[HITL] Tool '{tool_name}' is now trusted")
-            elif approval.lower() != "y":
-                event.cancel_tool = f"User denied execution of '{tool_name}'"
-                print(f"[HITL] Tool '{tool_name}' execution denied (pre-approved)")
-            else:
-                print(f"[HITL] Tool '{tool_name}' approved for single execution (pre-approved)")
-            return
-
         # 承認を要求
         print(f"[HITL] Requesting approval for tool: {tool_name}")
         approval = event.interrupt(
@@ -216,16 +466,52 @@ class ApprovalHook(HookProvider):
         )
 
         # 承認結果を処理
-        if approval.lower() == "t":  # trust - 今後は承認不要
+        decision = approval.lower()
+        if decision == "t":  # trust - 今後は承認不要
             event.agent.state.set(trust_key, "trusted")
             print(f"[HITL] Tool '{tool_name}' is now trusted")
-        elif approval.lower() != "y":
+        elif decision != "y":
             event.cancel_tool = f"User denied execution of '{tool_name}'"
             print(f"[HITL] Tool '{tool_name}' execution denied")
         else:
             print(f"[HITL] Tool '{tool_name}' approved for single execution")
 
 
+# ============================================================================
+# ツール結果キャッシュ
+# ============================================================================
+
+# 副作用の無い安全なツールの結果を (ツール名, 引数) ごとに短時間キャッシュし、
+# 同じ呼び出しを繰り返す計画や再開時にツールを再実行しない
+TOOL_CACHE_TTL = 60
+_tool_cache: TTLCache = TTLCache(maxsize=1024, ttl=TOOL_CACHE_TTL)
+_tool_cache_lock = threading.Lock()
+
+# Trueの間はキャッシュを読まずにツールを実行する（"cache": false で開始した実行だけに効かせる）
+_bypass_tool_cache: contextvars.ContextVar[bool] = contextvars.ContextVar("bypass_tool_cache", default=False)
+
+
+def cached_tool(func):
+    """ツール関数の結果をTTL付きでキャッシュするデコレータ（@tool の内側に付ける）"""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__, json.dumps(bound.arguments, sort_keys=True, default=str))
+        if not _bypass_tool_cache.get():
+            with _tool_cache_lock:
+                if key in _tool_cache:
+                    return _tool_cache[key]
+        result = func(*args, **kwargs)
+        with _tool_cache_lock:
+            _tool_cache[key] = result
+        return result
+
+    return wrapper
+
+
 # ============================================================================
 # サンプルツール
 # ============================================================================
@@ -250,25 +536,118 @@ def modify_database(query: str) -> str:
 
 
 @tool
+@cached_tool
 def list_files(directory: str = ".") -> str:
     """ディレクトリ内のファイル一覧を取得します（安全なツール）"""
     return f"Files in {directory}: file1.txt, file2.txt, file3.txt"
 
 
 @tool
+@cached_tool
 def read_file(path: str) -> str:
     """ファイルを読み取ります（安全なツール）"""
     return f"Content of {path}: Sample file content"
 
 
+# ============================================================================
+# エージェント
+# ============================================================================
+
+
+# 全セッションで共通のツールとシステムプロンプト（エージェント作成のたびに組み立てない）
+_TOOLS = (delete_files, execute_command, modify_database, list_files, read_file)
+_SYSTEM_PROMPT = """You are a helpful assistant that can manage files and execute commands.
+When asked to delete files or execute commands, use the appropriate tools.
+Always confirm what you will do before taking action."""
+
+
+def create_agent(session_id: str, **kwargs) -> Agent:
+    """承認フック付きのエージェントを作成（kwargsで messages/state を渡すと会話を復元）"""
+    return Agent(
+        model="jp.anthropic.claude-haiku-4-5-20251001-v1:0",
+        hooks=[ApprovalHook("hitl-demo", session_id)],
+        tools=list(_TOOLS),
+        system_prompt=_SYSTEM_PROMPT,
+        **kwargs,
+    )
+
+
+def snapshot_agent(agent: Agent) -> dict:
+    """Interrupt発生時のエージェントの状態をシリアライズ可能な形で取得（再開用）"""
+    return {
+        "messages": agent.messages,
+        "agent_state": agent.state.get(),
+        # 中断したツール呼び出しのコンテキスト（公開APIが無いためセッション永続化と同じ内部状態を使う）
+        "interrupt_state": agent._interrupt_state.to_dict(),
+    }
+
+
+def restore_agent(session_id: str, run_state: dict) -> Agent:
+    """snapshot_agent() で保存した状態からエージェントを復元"""
+    agent = create_agent(session_id, messages=run_state["messages"], state=run_state["agent_state"])
+    agent._interrupt_state = _InterruptState.from_dict(run_state["interrupt_state"])
+    return agent
+
+
+def build_interrupt_state(prompt: str, agent: Agent, interrupts: list) -> dict:
+    """DynamoDBの __state__ 行に保存する再開用の状態を作成"""
+    return {
+        "prompt": prompt,
+        "interrupts": [{"id": i.id, "name": i.name, "reason": i.reason} for i in interrupts],
+        "run_state": snapshot_agent(agent),
+    }
+
+
 # ============================================================================
 # AgentCore Runtime アプリケーション
 # ============================================================================
 
 app = BedrockAgentCoreApp(debug=True)
 
+# バックグラウンド処理用のスレッドプール（リクエストごとにスレッドを作らない）
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="hitl")
+atexit.register(_EXECUTOR.shutdown)
+
 # セッションごとの状態を保持（メモリ内キャッシュ）
-session_states: dict[str, dict] = {}
+# エージェント本体は保持せず、ステータス等のシリアライズ可能な値のみを置く（再開はDynamoDBから復元）。
+# 完了・エラーになったセッションは結果がDynamoDBにあるため、短時間だけ completed_states に残して破棄する。
+# バックグラウンドスレッドとリクエストスレッドの双方から更新するため _SESSION_LOCK で保護する
+COMPLETED_STATE_TTL = 60
+session_states: LRUCache = LRUCache(maxsize=SESSION_CACHE_SIZE)
+completed_states: TTLCache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=COMPLETED_STATE_TTL)
+_SESSION_LOCK = threading.RLock()
+
+
+def _get_session_state(session_id: str) -> Optional[dict]:
+    """メモリ内のセッション状態を取得"""
+    with _SESSION_LOCK:
+        return session_states.get(session_id) or completed_states.get(session_id)
+
+
+def _set_session_state(session_id: str, state: dict):
+    """メモリ内のセッション状態を更新（完了・エラーは completed_states へ移す）"""
+    with _SESSION_LOCK:
+        if state.get("status") in ("completed", "error"):
+            session_states.pop(session_id, None)
+            completed_states[session_id] = state
+        else:
+            completed_states.pop(session_id, None)
+            session_states[session_id] = state
+
+
+# アクション名 -> ハンドラ (payload, session_id) のディスパッチテーブル
+_ACTIONS = {
+    "start": lambda p, s: start_agent_task(p, s),
+    "list_pending": lambda p, s: list_pending_approvals(p.get("filter_session_id"), p.get("since")),
+    "approve": lambda p, s: approve_request(s, p),
+    "reject": lambda p, s: reject_request(s, p),
+    "resume": lambda p, s: resume_agent_task(s),
+    "approve_and_resume": lambda p, s: approve_and_resume(s, p),
+    "result": lambda p, s: get_result(s),
+    "status": lambda p, s: get_status(s),
+    # UIからのウォームアップ用（何もしない）
+    "ping": lambda p, s: {"status": "ok"},
+}
 
 
 @app.entrypoint
@@ -279,43 +658,29 @@ def handler(payload: dict, context: RequestContext) -> dict:
 
     print(f"[HITL] Action: {action}, Session: {session_id}")
 
-    if action == "start":
-        return start_agent_task(payload, session_id)
-    elif action == "list_pending":
-        return list_pending_approvals(payload.get("filter_session_id"))
-    elif action == "approve":
-        return approve_request(session_id, payload)
-    elif action == "reject":
-        return reject_request(session_id, payload)
-    elif action == "resume":
-        return resume_agent_task(session_id)
-    elif action == "result":
-        return get_result(session_id)
-    elif action == "status":
-        return get_status(session_id)
-    else:
+    fn = _ACTIONS.get(action)
+    if fn is None:
         return {"error": f"Unknown action: {action}"}
+    return fn(payload, session_id)
 
 
 def start_agent_task(payload: dict, session_id: str) -> dict:
     """エージェントタスクをバックグラウンドで開始"""
     prompt = payload.get("prompt", "Hello!")
 
+    # "cache": false が指定された場合はこの実行だけツール結果キャッシュを読まない
+    bypass_cache = payload.get("cache") is False
+
     # 非同期タスクを登録
     task_id = app.add_async_task("agent_processing", {"session_id": session_id})
     print(f"[HITL] Started async task: {task_id}")
 
     def background_work():
+        # コピーしたコンテキスト内で実行するため、他のセッションやワーカースレッドの次の処理には影響しない
+        _bypass_tool_cache.set(bypass_cache)
         try:
             # エージェントを作成
-            agent = Agent(
-                model="jp.anthropic.claude-haiku-4-5-20251001-v1:0",
-                hooks=[ApprovalHook("hitl-demo", session_id)],
-                tools=[delete_files, execute_command, modify_database, list_files, read_file],
-                system_prompt="""You are a helpful assistant that can manage files and execute commands.
-When asked to delete files or execute commands, use the appropriate tools.
-Always confirm what you will do before taking action.""",
-            )
+            agent = create_agent(session_id)
 
             # エージェントを実行
             result = agent(prompt)
@@ -324,44 +689,36 @@ Always confirm what you will do before taking action.""",
             if result.stop_reason == "interrupt":
                 print(f"[HITL] Agent interrupted, {len(result.interrupts)} approval(s) pending")
 
-                # 承認待ち状態を保存
+                # 承認待ち状態とエージェントの状態（再開用）をまとめて保存
+                save_interrupts(
+                    session_id=session_id,
+                    interrupts=result.interrupts,
+                    state=build_interrupt_state(prompt, agent, result.interrupts),
+                )
                 for interrupt in result.interrupts:
-                    save_pending_approval(
-                        session_id=session_id,
-                        interrupt_id=interrupt.id,
-                        name=interrupt.name,
-                        reason=interrupt.reason,
-                    )
                     print(f"[HITL] Saved pending approval: {interrupt.id}")
 
-                # エージェントの状態を保存（再開用）
-                save_agent_state(
-                    session_id=session_id,
-                    state={
-                        "prompt": prompt,
-                        "interrupts": [
-                            {"id": i.id, "name": i.name, "reason": i.reason}
-                            for i in result.interrupts
-                        ],
+                # メモリ内にも保持
+                _set_session_state(
+                    session_id,
+                    {
+                        "status": "waiting_approval",
+                        "interrupt_ids": [i.id for i in result.interrupts],
                     },
                 )
-
-                # メモリ内にも保持
-                session_states[session_id] = {
-                    "agent": agent,
-                    "result": result,
-                    "status": "waiting_approval",
-                }
             else:
                 # 正常完了
                 print(f"[HITL] Agent completed: {result.stop_reason}")
-                save_agent_result(session_id, {"message": result.message, "stop_reason": result.stop_reason})
-                session_states[session_id] = {"status": "completed", "message": result.message}
+                save_agent_result(
+                    session_id, {"message": result.message, "stop_reason": result.stop_reason}, clear_state=True
+                )
+                _set_session_state(session_id, {"status": "completed", "message": result.message})
 
         except Exception as e:
             print(f"[HITL] Agent error: {e}")
-            save_agent_result(session_id, {"error": str(e)})
-            session_states[session_id] = {"status": "error", "error": str(e)}
+            # エラーになったセッションも再開できないよう __state__ を削除する
+            save_agent_result(session_id, {"error": str(e)}, clear_state=True)
+            _set_session_state(session_id, {"status": "error", "error": str(e)})
 
         finally:
             # 非同期タスクを完了
@@ -369,8 +726,7 @@ Always confirm what you will do before taking action.""",
             print(f"[HITL] Completed async task: {task_id}")
 
     # バックグラウンドスレッドで実行
-    thread = threading.Thread(target=background_work, daemon=True)
-    thread.start()
+    _EXECUTOR.submit(contextvars.copy_context().run, background_work)
 
     return {
         "status": "started",
@@ -380,9 +736,9 @@ Always confirm what you will do before taking action.""",
     }
 
 
-def list_pending_approvals(filter_session_id: Optional[str] = None) -> dict:
+def list_pending_approvals(filter_session_id: Optional[str] = None, since: Optional[str] = None) -> dict:
     """承認待ちリクエスト一覧を取得"""
-    items = get_pending_approvals(filter_session_id)
+    items = get_pending_approvals(filter_session_id, since)
     return {
         "pending_approvals": items,
         "count": len(items),
@@ -398,7 +754,8 @@ def approve_request(session_id: str, payload: dict) -> dict:
     if not interrupt_id:
         return {"error": "interrupt_id is required"}
 
-    update_approval_status(session_id, interrupt_id, "approved", response, approver)
+    if not update_approval_status(session_id, interrupt_id, "approved", response, approver):
+        return {"error": f"Approval is not pending: {interrupt_id}"}
     print(f"[HITL] Approved: {interrupt_id}")
 
     return {
@@ -419,7 +776,8 @@ def reject_request(session_id: str, payload: dict) -> dict:
     if not interrupt_id:
         return {"error": "interrupt_id is required"}
 
-    update_approval_status(session_id, interrupt_id, "rejected", "n", approver)
+    if not update_approval_status(session_id, interrupt_id, "rejected", "n", approver):
+        return {"error": f"Approval is not pending: {interrupt_id}"}
     print(f"[HITL] Rejected: {interrupt_id}")
 
     return {
@@ -433,150 +791,94 @@ def reject_request(session_id: str, payload: dict) -> dict:
 
 def resume_agent_task(session_id: str) -> dict:
     """承認後にエージェントタスクを再開"""
-    # メモリ内の状態を確認
-    state = session_states.get(session_id)
-
-    if not state:
-        # DynamoDBから状態を復元
-        saved_state = get_agent_state(session_id)
-        if not saved_state:
-            return {"error": f"No pending session found: {session_id}"}
-
-        # 承認状況を確認し、ツール名 -> 承認レスポンスのマッピングを構築
-        interrupts = saved_state.get("interrupts", [])
-        pre_approved_tools: dict[str, str] = {}
-        pending_interrupts = []
-
-        for interrupt in interrupts:
-            approval_response = get_approval_response(session_id, interrupt["id"])
-            if approval_response:
-                # reasonからツール名を取得
-                reason = interrupt.get("reason", {})
-                tool_name = reason.get("tool") if isinstance(reason, dict) else None
-                if tool_name:
-                    pre_approved_tools[tool_name] = approval_response
-                    print(f"[HITL] Pre-approved tool: {tool_name} -> {approval_response}")
-            else:
-                pending_interrupts.append(interrupt)
+    # メモリ内の状態を確認（承認待ち以外のセッションは再開しない）
+    state = _get_session_state(session_id)
+    if state and state.get("status") != "waiting_approval":
+        return {"error": f"Session is not waiting for approval: {state.get('status')}"}
 
-        if pending_interrupts:
-            return {
-                "error": "Not all approvals have been responded to",
-                "pending": pending_interrupts,
-            }
+    # DynamoDBから状態を復元
+    saved_state = get_agent_state(session_id)
+    if not saved_state:
+        return {"error": f"No pending session found: {session_id}"}
 
-        # 元のプロンプトを取得
-        original_prompt = saved_state.get("prompt", "")
-        if not original_prompt:
-            return {"error": "Original prompt not found in saved state"}
-
-        # エージェントを再作成して元のプロンプトを再実行（事前承認付き）
-        task_id = app.add_async_task("agent_resume", {"session_id": session_id})
-
-        def resume_work():
-            try:
-                # 事前承認されたツールを渡してエージェントを作成
-                agent = Agent(
-                    model="jp.anthropic.claude-haiku-4-5-20251001-v1:0",
-                    hooks=[ApprovalHook("hitl-demo", session_id, pre_approved_tools=pre_approved_tools)],
-                    tools=[delete_files, execute_command, modify_database, list_files, read_file],
-                    system_prompt="""You are a helpful assistant that can manage files and execute commands.
-When asked to delete files or execute commands, use the appropriate tools.
-Always confirm what you will do before taking action.""",
-                )
+    run_state = saved_state.get("run_state")
+    if not run_state:
+        return {"error": "Agent run state not found in saved state"}
 
-                # 元のプロンプトを再実行（事前承認が適用される）
-                print(f"[HITL] Re-running prompt with pre-approved tools: {list(pre_approved_tools.keys())}")
-                result = agent(original_prompt)
-
-                if result.stop_reason == "interrupt":
-                    # 新しいInterruptが発生（別のツール）
-                    for interrupt in result.interrupts:
-                        save_pending_approval(session_id, interrupt.id, interrupt.name, interrupt.reason)
-                    save_agent_state(
-                        session_id,
-                        {
-                            "prompt": original_prompt,
-                            "interrupts": [{"id": i.id, "name": i.name, "reason": i.reason} for i in result.interrupts],
-                        },
-                    )
-                    session_states[session_id] = {"agent": agent, "result": result, "status": "waiting_approval"}
-                else:
-                    save_agent_result(session_id, {"message": result.message, "stop_reason": result.stop_reason})
-                    session_states[session_id] = {"status": "completed", "message": result.message}
-
-            except Exception as e:
-                print(f"[HITL] Resume error: {e}")
-                import traceback
-                traceback.print_exc()
-                save_agent_result(session_id, {"error": str(e)})
-
-            finally:
-                app.complete_async_task(task_id)
-
-        thread = threading.Thread(target=resume_work, daemon=True)
-        thread.start()
+    # 承認状況を確認し、interruptResponse形式のレスポンスを構築
+    interrupts = saved_state.get("interrupts", [])
+    approval_responses = get_approval_responses_bulk(session_id, [i["id"] for i in interrupts])
+    responses = []
+    pending_interrupts = []
+
+    for interrupt in interrupts:
+        approval_response = approval_responses.get(interrupt["id"])
+        if approval_response:
+            responses.append(
+                {
+                    "interruptResponse": {
+                        "interruptId": interrupt["id"],
+                        "response": approval_response,
+                    }
+                }
+            )
+        else:
+            pending_interrupts.append(interrupt)
 
+    if pending_interrupts:
         return {
-            "status": "resuming",
-            "session_id": session_id,
-            "task_id": task_id,
-            "pre_approved_tools": list(pre_approved_tools.keys()),
-            "message": "Agent resuming by re-running prompt with pre-approved tools.",
+            "error": "Not all approvals have been responded to",
+            "pending": pending_interrupts,
         }
 
-    # メモリ内に状態がある場合
-    if state.get("status") != "waiting_approval":
-        return {"error": f"Session is not waiting for approval: {state.get('status')}"}
-
-    agent = state.get("agent")
-    prev_result = state.get("result")
-
-    if not agent or not prev_result:
-        return {"error": "Invalid session state"}
-
-    # 承認状況を確認
-    responses = []
-    for interrupt in prev_result.interrupts:
-        approval_response = get_approval_response(session_id, interrupt.id)
-        if not approval_response:
-            return {
-                "error": f"Approval not found for interrupt: {interrupt.id}",
-                "interrupt": {"id": interrupt.id, "name": interrupt.name, "reason": interrupt.reason},
-            }
-        responses.append(
-            {
-                "interruptResponse": {
-                    "interruptId": interrupt.id,
-                    "response": approval_response,
-                }
-            }
-        )
+    # DynamoDB上で再開する権利を取得し、並行したresumeによる二重再開を防ぐ（別プロセス・別VMからのresumeも含む）
+    if not claim_agent_state(session_id):
+        return {"error": f"Session is already resuming or no longer interrupted: {session_id}"}
+    _set_session_state(session_id, {"status": "resuming"})
 
-    # 非同期タスクを登録して再開
+    # 保存した状態からエージェントを復元し、承認レスポンスで続きから再開
     task_id = app.add_async_task("agent_resume", {"session_id": session_id})
+    original_prompt = saved_state.get("prompt", "")
 
     def resume_work():
         try:
+            agent = restore_agent(session_id, run_state)
+
+            print(f"[HITL] Resuming agent with {len(responses)} response(s)")
             result = agent(responses)
 
             if result.stop_reason == "interrupt":
-                for interrupt in result.interrupts:
-                    save_pending_approval(session_id, interrupt.id, interrupt.name, interrupt.reason)
-                session_states[session_id] = {"agent": agent, "result": result, "status": "waiting_approval"}
+                # 新しいInterruptが発生（別のツール）
+                save_interrupts(
+                    session_id,
+                    result.interrupts,
+                    build_interrupt_state(original_prompt, agent, result.interrupts),
+                )
+                _set_session_state(
+                    session_id,
+                    {
+                        "status": "waiting_approval",
+                        "interrupt_ids": [i.id for i in result.interrupts],
+                    },
+                )
             else:
-                save_agent_result(session_id, {"message": result.message, "stop_reason": result.stop_reason})
-                session_states[session_id] = {"status": "completed", "message": result.message}
+                save_agent_result(
+                    session_id, {"message": result.message, "stop_reason": result.stop_reason}, clear_state=True
+                )
+                _set_session_state(session_id, {"status": "completed", "message": result.message})
 
         except Exception as e:
             print(f"[HITL] Resume error: {e}")
-            save_agent_result(session_id, {"error": str(e)})
+            import traceback
+            traceback.print_exc()
+            # エラーになったセッションも再開できないよう __state__ を削除する
+            save_agent_result(session_id, {"error": str(e)}, clear_state=True)
+            _set_session_state(session_id, {"status": "error", "error": str(e)})
 
         finally:
             app.complete_async_task(task_id)
 
-    thread = threading.Thread(target=resume_work, daemon=True)
-    thread.start()
+    _EXECUTOR.submit(resume_work)
 
     return {
         "status": "resuming",
@@ -586,10 +888,18 @@ Always confirm what you will do before taking action.""",
     }
 
 
+def approve_and_resume(session_id: str, payload: dict) -> dict:
+    """承認を記録し、続けてエージェントを再開（1回の呼び出しで完結させる）"""
+    result = approve_request(session_id, payload)
+    if result.get("status") != "approved":
+        return result
+    return {**result, "resume": resume_agent_task(session_id)}
+
+
 def get_result(session_id: str) -> dict:
     """エージェントの実行結果を取得"""
     # メモリ内の状態を確認
-    state = session_states.get(session_id)
+    state = _get_session_state(session_id)
     if state:
         response = {"session_id": session_id, "status": state.get("status")}
         # None以外の値のみ含める
@@ -610,7 +920,7 @@ def get_result(session_id: str) -> dict:
 def get_status(session_id: str) -> dict:
     """セッションの状態を取得"""
     # メモリ内の状態を確認
-    state = session_states.get(session_id)
+    state = _get_session_state(session_id)
     if state:
         return {
             "session_id": session_id,
@@ -618,8 +928,9 @@ def get_status(session_id: str) -> dict:
             "in_memory": True,
         }
 
-    # DynamoDBから状態を確認
-    saved_state = get_agent_state(session_id)
+    # DynamoDBから状態と結果を1回で取得して判定
+    rows = _get_session_rows(session_id)
+    saved_state = rows["__state__"]
     if saved_state:
         return {
             "session_id": session_id,
@@ -628,7 +939,7 @@ def get_status(session_id: str) -> dict:
             "interrupts": saved_state.get("interrupts", []),
         }
 
-    result = get_agent_result(session_id)
+    result = rows["__result__"]
     if result:
         return {
             "session_id": session_id,
@@ -11,15 +11,23 @@ interrupt発生時にcomplete_async_task()を呼ばず、HealthyBusy状態を維
 - 待機中はメモリ課金あり(CPUは無料)
 """
 
+import atexit
+import logging
+import os
 import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 
+from cachetools import TTLCache
 from bedrock_agentcore.runtime.app import BedrockAgentCoreApp
 from bedrock_agentcore.runtime.context import RequestContext
 from strands import Agent, tool
 from strands.hooks import BeforeToolCallEvent, HookProvider, HookRegistry
+# 再開用の状態の保存・復元に非公開APIの _InterruptState.to_dict/from_dict と Agent._interrupt_state を使う
+# (strands-agents 1.16.0 以降。requirements.txt でバージョン範囲を固定)
+from strands.interrupt import _InterruptState
 
 # ============================================================================
 # 設定
@@ -27,16 +35,175 @@ from strands.hooks import BeforeToolCallEvent, HookProvider, HookRegistry
 
 DANGEROUS_TOOLS = ["delete_files", "execute_command", "modify_database"]
 
+# ログ(HITL_LOG_LEVEL=WARNING などで抑制すると、メッセージの組み立て自体が行われない)
+logger = logging.getLogger("hitl")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("[HITL] %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+# 不正な値で起動に失敗しないよう、解釈できないレベル名はINFOとして扱う
+_log_level = getattr(logging, os.getenv("HITL_LOG_LEVEL", "INFO").upper(), None)
+logger.setLevel(_log_level if isinstance(_log_level, int) else logging.INFO)
+
 # ============================================================================
 # メモリ内ストレージ
 # ============================================================================
 
+# エントリの保持期間はmax_lifetime(8時間)に合わせる。
+# それ以上待機したセッションはコンテナごと終了しているため、放置・エラーのエントリもこの時間で失効させる
+SESSION_TTL_SECONDS = 8 * 60 * 60
+SESSION_CACHE_SIZE = 1024
+
+
+class EvictingTTLCache(TTLCache):
+    """失効・容量超過でエントリが破棄されたときにコールバックを呼ぶTTLCache"""
+
+    def __init__(self, maxsize: int, ttl: float, on_evict):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._on_evict(key, value)
+        return key, value
+
+    def expire(self, time=None):
+        # 失効したエントリを返すのは cachetools 5.5.0 以降(requirements.txt で固定)
+        expired = super().expire(time)
+        for key, value in expired:
+            self._on_evict(key, value)
+        return expired
+
+
+def _on_session_evicted(session_id: str, state: dict) -> None:
+    """破棄されたセッションの承認待ちを削除し、承認待ちのままなら非同期タスクを完了させる(HealthyBusyのまま残さない)"""
+    pending_approvals.pop(session_id, None)
+    if state.get("status") == "waiting_approval" and state.get("task_id"):
+        app.complete_async_task(state["task_id"])
+        logger.info("Session evicted, completed async task: %s", state["task_id"])
+
+
+class ShardedSessionStore:
+    """キーのハッシュでシャードに分割し、シャードごとのロックで保護するTTL付きストア
+
+    セッション同士は独立しているため、1つのグローバルロックを全スレッドで取り合わないように分割する。
+    maxsize=Noneの場合は容量・TTLを持たず、削除は呼び出し側で行う。
+    """
+
+    def __init__(self, n: int = 16, maxsize: Optional[int] = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL_SECONDS, on_evict=None):
+        def new_shard():
+            if maxsize is None:
+                return {}
+            per_shard = max(1, maxsize // n)
+            if on_evict:
+                return EvictingTTLCache(per_shard, ttl, on_evict)
+            return TTLCache(maxsize=per_shard, ttl=ttl)
+
+        self._shards = [(new_shard(), threading.RLock()) for _ in range(n)]
+
+    def _shard(self, key: str):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def lock(self, key: str) -> threading.RLock:
+        """複数の操作をまとめて行うためのシャードロック"""
+        return self._shard(key)[1]
+
+    def get(self, key: str, default=None):
+        cache, lock = self._shard(key)
+        with lock:
+            return cache.get(key, default)
+
+    def set(self, key: str, value) -> None:
+        cache, lock = self._shard(key)
+        with lock:
+            cache[key] = value
+
+    def setdefault(self, key: str, default):
+        cache, lock = self._shard(key)
+        with lock:
+            return cache.setdefault(key, default)
+
+    def pop(self, key: str, default=None):
+        cache, lock = self._shard(key)
+        with lock:
+            return cache.pop(key, default)
+
+    def values(self, project=None) -> list:
+        """全シャードの値のスナップショット(シャードごとに短時間だけロックする)
+
+        projectを渡すと、各値をシャードのロック内で変換してから返す。
+        """
+        result = []
+        for cache, lock in self._shards:
+            with lock:
+                result.extend(project(value) if project else value for value in cache.values())
+        return result
+
+
 # セッション状態(エージェント、結果、ステータス)
-session_states: dict[str, dict] = {}
+session_states = ShardedSessionStore(on_evict=_on_session_evicted)
 
 # 承認待ちリクエスト(interrupt情報)
-# session_id -> [approval_info, ...]
-pending_approvals: dict[str, list[dict]] = {}
+# session_id -> {"approvals": {interrupt_id: approval_info}, "pending": {interrupt_id: approval_info}}
+# "approvals" は再開で消費されていないinterrupt、"pending" はそのうち未処理(status == "pending")のもの。
+# セッションの完了・エラー・破棄と同時に削除するため、独自の容量・TTLは持たない
+pending_approvals = ShardedSessionStore(maxsize=None)
+
+
+def _add_pending_approvals(session_id: str, interrupts) -> None:
+    """interruptを承認待ちとして登録し、interrupt_idから引けるようにする"""
+    # 同じターンのinterruptは同じ時刻として扱う
+    now_iso = datetime.now().isoformat()
+    with pending_approvals.lock(session_id):
+        entry = pending_approvals.setdefault(session_id, {"approvals": {}, "pending": {}})
+        for interrupt in interrupts:
+            approval = {
+                "session_id": session_id,
+                "interrupt_id": interrupt.id,
+                "name": interrupt.name,
+                "reason": interrupt.reason,
+                "status": "pending",
+                "created_at": now_iso,
+            }
+            entry["approvals"][interrupt.id] = approval
+            entry["pending"][interrupt.id] = approval
+            logger.info("Saved pending approval: %s", interrupt.id)
+
+
+def _clear_pending_approvals(session_id: str) -> None:
+    """セッションの承認待ちを削除"""
+    pending_approvals.pop(session_id, None)
+
+
+def _find_approval(session_id: str, interrupt_id: str) -> Optional[dict]:
+    """interrupt_idから承認情報を取得(別セッションのものは返さない)"""
+    entry = pending_approvals.get(session_id)
+    return entry["approvals"].get(interrupt_id) if entry else None
+
+
+def get_approval_response(session_id: str, interrupt_id: str) -> Optional[str]:
+    """承認・拒否済みのinterruptのレスポンスを取得(未処理・不明な場合はNone)"""
+    approval = _find_approval(session_id, interrupt_id)
+    if approval is None or approval["status"] not in ("approved", "rejected"):
+        return None
+    return approval.get("response")
+
+
+def _resolve_approval(session_id: str, approval: dict) -> None:
+    """承認・拒否された承認情報を未処理ビューから取り除く(呼び出し側でセッションのロックを保持する)"""
+    entry = pending_approvals.get(session_id)
+    if entry:
+        entry["pending"].pop(approval["interrupt_id"], None)
+
+
+def _consume_approvals(session_id: str, interrupt_ids) -> None:
+    """再開に使った承認情報を削除する(次のターンのinterruptだけを残す)"""
+    with pending_approvals.lock(session_id):
+        entry = pending_approvals.get(session_id)
+        if entry:
+            for interrupt_id in interrupt_ids:
+                entry["approvals"].pop(interrupt_id, None)
 
 
 # ============================================================================
@@ -63,11 +230,11 @@ class ApprovalHook(HookProvider):
         # 既に信頼済みならスキップ
         trust_key = f"{self.app_name}-{tool_name}-trust"
         if event.agent.state.get(trust_key) == "trusted":
-            print(f"[HITL] Tool '{tool_name}' is trusted, skipping approval")
+            logger.info("Tool '%s' is trusted, skipping approval", tool_name)
             return
 
         # 承認を要求
-        print(f"[HITL] Requesting approval for tool: {tool_name}")
+        logger.info("Requesting approval for tool: %s", tool_name)
         approval = event.interrupt(
             f"{self.app_name}-{tool_name}-approval",
             reason={
@@ -80,12 +247,12 @@ class ApprovalHook(HookProvider):
         # 承認結果を処理
         if approval.lower() == "t":  # trust - 今後は承認不要
             event.agent.state.set(trust_key, "trusted")
-            print(f"[HITL] Tool '{tool_name}' is now trusted")
+            logger.info("Tool '%s' is now trusted", tool_name)
         elif approval.lower() != "y":
             event.cancel_tool = f"User denied execution of '{tool_name}'"
-            print(f"[HITL] Tool '{tool_name}' execution denied")
+            logger.info("Tool '%s' execution denied", tool_name)
         else:
-            print(f"[HITL] Tool '{tool_name}' approved for single execution")
+            logger.info("Tool '%s' approved for single execution", tool_name)
 
 
 # ============================================================================
@@ -123,12 +290,94 @@ def read_file(path: str) -> str:
     return f"Content of {path}: Sample file content"
 
 
+# ============================================================================
+# エージェント
+# ============================================================================
+
+
+# 全セッションで共通のツールとシステムプロンプト(エージェント作成のたびに組み立てない)
+_TOOLS = (delete_files, execute_command, modify_database, list_files, read_file)
+_SYSTEM_PROMPT = """You are a helpful assistant that can manage files and execute commands.
+When asked to delete files or execute commands, use the appropriate tools.
+Always confirm what you will do before taking action."""
+
+
+def create_agent(session_id: str, **kwargs) -> Agent:
+    """承認フック付きのエージェントを作成(kwargsで messages/state を渡すと会話を復元)"""
+    return Agent(
+        model="jp.anthropic.claude-haiku-4-5-20251001-v1:0",
+        hooks=[ApprovalHook("hitl-demo", session_id)],
+        tools=list(_TOOLS),
+        system_prompt=_SYSTEM_PROMPT,
+        **kwargs,
+    )
+
+
+def snapshot_agent(agent: Agent) -> dict:
+    """Interrupt発生時のエージェントの状態を取得(再開用)"""
+    return {
+        "messages": agent.messages,
+        "agent_state": agent.state.get(),
+        # 中断したツール呼び出しのコンテキスト(公開APIが無いためセッション永続化と同じ内部状態を使う)
+        "interrupt_state": agent._interrupt_state.to_dict(),
+    }
+
+
+def restore_agent(session_id: str, run_state: dict) -> Agent:
+    """snapshot_agent() で取得した状態からエージェントを復元"""
+    agent = create_agent(session_id, messages=run_state["messages"], state=run_state["agent_state"])
+    agent._interrupt_state = _InterruptState.from_dict(run_state["interrupt_state"])
+    return agent
+
+
+def build_waiting_state(prompt: str, task_id: str, agent: Agent, interrupts: list) -> dict:
+    """承認待ちセッションの状態を作成
+
+    エージェント本体(モデルクライアント・フック・ツール)は保持せず、再開に必要な会話とinterruptだけを残す。
+    """
+    return {
+        "status": "waiting_approval",
+        "prompt": prompt,
+        "task_id": task_id,  # 元のタスクIDを保存
+        "interrupts": [{"id": i.id, "name": i.name, "reason": i.reason} for i in interrupts],
+        "run_state": snapshot_agent(agent),
+    }
+
+
 # ============================================================================
 # AgentCore Runtime アプリケーション
 # ============================================================================
 
 app = BedrockAgentCoreApp(debug=True)
 
+# エージェント(Bedrock呼び出し)用のI/Oプールと、結果を状態に反映する計算用プールを分ける。
+# 待ち時間の長いLLM呼び出しで状態更新が詰まらないようにする
+MAX_CONCURRENT_AGENTS = int(os.getenv("HITL_MAX_WORKERS", "32"))
+_io_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_AGENTS, thread_name_prefix="hitl-io")
+_cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="hitl-cpu")
+atexit.register(_io_pool.shutdown, wait=False)
+atexit.register(_cpu_pool.shutdown, wait=False)
+
+
+def _submit_agent_work(run, on_done) -> None:
+    """runをI/Oプールで実行し、完了したFutureをon_doneに渡して計算用プールで処理する"""
+    future = _io_pool.submit(run)
+    future.add_done_callback(lambda f: _cpu_pool.submit(on_done, f))
+
+
+# アクション名 -> ハンドラ (payload, session_id) のディスパッチテーブル
+_ACTIONS = {
+    "start": lambda p, s: start_agent_task(p, s),
+    "list_pending": lambda p, s: list_pending_approvals_handler(p.get("filter_session_id")),
+    "approve": lambda p, s: approve_request(s, p),
+    "reject": lambda p, s: reject_request(s, p),
+    "resume": lambda p, s: resume_agent_task(s),
+    "approve_and_resume": lambda p, s: approve_and_resume(s, p),
+    "reject_and_resume": lambda p, s: reject_and_resume(s, p),
+    "result": lambda p, s: get_result(s),
+    "status": lambda p, s: get_status(s),
+}
+
 
 @app.entrypoint
 def handler(payload: dict, context: RequestContext) -> dict:
@@ -136,24 +385,12 @@ def handler(payload: dict, context: RequestContext) -> dict:
     action = payload.get("action", "start")
     session_id = payload.get("session_id") or context.session_id or str(uuid.uuid4())
 
-    print(f"[HITL] Action: {action}, Session: {session_id}")
-
-    if action == "start":
-        return start_agent_task(payload, session_id)
-    elif action == "list_pending":
-        return list_pending_approvals_handler(payload.get("filter_session_id"))
-    elif action == "approve":
-        return approve_request(session_id, payload)
-    elif action == "reject":
-        return reject_request(session_id, payload)
-    elif action == "resume":
-        return resume_agent_task(session_id)
-    elif action == "result":
-        return get_result(session_id)
-    elif action == "status":
-        return get_status(session_id)
-    else:
+    logger.info("Action: %s, Session: %s", action, session_id)
+
+    fn = _ACTIONS.get(action)
+    if fn is None:
         return {"error": f"Unknown action: {action}"}
+    return fn(payload, session_id)
 
 
 def start_agent_task(payload: dict, session_id: str) -> dict:
@@ -162,83 +399,58 @@ def start_agent_task(payload: dict, session_id: str) -> dict:
 
     # 非同期タスクを登録(HealthyBusy状態へ)
     task_id = app.add_async_task("agent_processing", {"session_id": session_id})
-    print(f"[HITL] Started async task: {task_id}")
+    logger.info("Started async task: %s", task_id)
 
-    # interruptが発生したかどうかを追跡
-    interrupt_occurred = False
+    def run_agent():
+        # エージェントを作成して実行(Bedrock呼び出し)
+        agent = create_agent(session_id)
+        return agent, agent(prompt)
 
-    def background_work():
-        nonlocal interrupt_occurred
+    def record_result(future):
+        # interruptが発生したかどうかを追跡
+        interrupt_occurred = False
         try:
-            # エージェントを作成
-            agent = Agent(
-                model="jp.anthropic.claude-haiku-4-5-20251001-v1:0",
-                hooks=[ApprovalHook("hitl-demo", session_id)],
-                tools=[delete_files, execute_command, modify_database, list_files, read_file],
-                system_prompt="""You are a helpful assistant that can manage files and execute commands.
-When asked to delete files or execute commands, use the appropriate tools.
-Always confirm what you will do before taking action.""",
-            )
-
-            # エージェントを実行
-            result = agent(prompt)
+            agent, result = future.result()
 
             # Interruptが発生した場合
             if result.stop_reason == "interrupt":
                 interrupt_occurred = True
-                print(f"[HITL] Agent interrupted, {len(result.interrupts)} approval(s) pending")
+                logger.info("Agent interrupted, %s approval(s) pending", len(result.interrupts))
 
                 # 承認待ち状態をメモリに保存
-                for interrupt in result.interrupts:
-                    pending_approvals.setdefault(session_id, []).append({
-                        "session_id": session_id,
-                        "interrupt_id": interrupt.id,
-                        "name": interrupt.name,
-                        "reason": interrupt.reason,
-                        "status": "pending",
-                        "created_at": datetime.now().isoformat(),
-                    })
-                    print(f"[HITL] Saved pending approval: {interrupt.id}")
-
-                # セッション状態をメモリに保存(エージェントインスタンスも保持)
-                session_states[session_id] = {
-                    "agent": agent,
-                    "result": result,
-                    "status": "waiting_approval",
-                    "prompt": prompt,
-                    "task_id": task_id,  # 元のタスクIDを保存
-                }
+                _add_pending_approvals(session_id, result.interrupts)
+
+                # セッション状態をメモリに保存(再開用の会話状態のみ。エージェントは再開時に復元)
+                session_states.set(session_id, build_waiting_state(prompt, task_id, agent, result.interrupts))
 
                 # 重要: complete_async_task()を呼ばない
                 # → HealthyBusy維持 → コンテナ存続 → メモリ保持
-                print(f"[HITL] Staying HealthyBusy to preserve memory state")
+                logger.info("Staying HealthyBusy to preserve memory state")
                 return  # finallyをスキップ
 
             else:
                 # 正常完了
-                print(f"[HITL] Agent completed: {result.stop_reason}")
-                session_states[session_id] = {
+                logger.info("Agent completed: %s", result.stop_reason)
+                session_states.set(session_id, {
                     "status": "completed",
                     "message": result.message,
-                }
+                })
                 # 完了したので承認待ちをクリア
-                pending_approvals.pop(session_id, None)
+                _clear_pending_approvals(session_id)
 
         except Exception as e:
-            print(f"[HITL] Agent error: {e}")
-            import traceback
-            traceback.print_exc()
-            session_states[session_id] = {"status": "error", "error": str(e)}
+            logger.exception("Agent error: %s", e)
+            session_states.set(session_id, {"status": "error", "error": str(e)})
+            _clear_pending_approvals(session_id)
 
         finally:
             # interruptが発生した場合はcomplete_async_task()を呼ばない
             if not interrupt_occurred:
                 app.complete_async_task(task_id)
-                print(f"[HITL] Completed async task: {task_id}")
+                logger.info("Completed async task: %s", task_id)
 
-    # バックグラウンドスレッドで実行
-    thread = threading.Thread(target=background_work, daemon=True)
-    thread.start()
+    # LLM呼び出しはI/Oプール、状態の更新は計算用プールで実行
+    _submit_agent_work(run_agent, record_result)
 
     return {
         "status": "started",
@@ -251,15 +463,14 @@ Always confirm what you will do before taking action.""",
 def list_pending_approvals_handler(filter_session_id: Optional[str] = None) -> dict:
     """承認待ちリクエスト一覧を取得(メモリから)"""
     if filter_session_id:
-        items = [
-            a for a in pending_approvals.get(filter_session_id, [])
-            if a.get("status") == "pending"
-        ]
+        with pending_approvals.lock(filter_session_id):
+            entry = pending_approvals.get(filter_session_id)
+            items = list(entry["pending"].values()) if entry else []
     else:
         items = [
-            a for approvals in pending_approvals.values()
-            for a in approvals
-            if a.get("status") == "pending"
+            approval
+            for approvals in pending_approvals.values(lambda entry: list(entry["pending"].values()))
+            for approval in approvals
         ]
 
     return {
@@ -278,20 +489,20 @@ def approve_request(session_id: str, payload: dict) -> dict:
         return {"error": "interrupt_id is required"}
 
     # メモリ内の承認待ちを更新
-    found = False
-    for approval in pending_approvals.get(session_id, []):
-        if approval["interrupt_id"] == interrupt_id:
+    approval = _find_approval(session_id, interrupt_id)
+    found = approval is not None
+    if found:
+        with pending_approvals.lock(session_id):
             approval["status"] = "approved"
             approval["response"] = response
             approval["approver"] = approver
             approval["updated_at"] = datetime.now().isoformat()
-            found = True
-            break
+            _resolve_approval(session_id, approval)
 
     if not found:
         return {"error": f"Approval not found: {interrupt_id}"}
 
-    print(f"[HITL] Approved: {interrupt_id} with response: {response}")
+    logger.info("Approved: %s with response: %s", interrupt_id, response)
 
     return {
         "status": "approved",
@@ -312,21 +523,21 @@ def reject_request(session_id: str, payload: dict) -> dict:
         return {"error": "interrupt_id is required"}
 
     # メモリ内の承認待ちを更新
-    found = False
-    for approval in pending_approvals.get(session_id, []):
-        if approval["interrupt_id"] == interrupt_id:
+    approval = _find_approval(session_id, interrupt_id)
+    found = approval is not None
+    if found:
+        with pending_approvals.lock(session_id):
             approval["status"] = "rejected"
             approval["response"] = "n"
             approval["approver"] = approver
             approval["rejection_reason"] = reason
             approval["updated_at"] = datetime.now().isoformat()
-            found = True
-            break
+            _resolve_approval(session_id, approval)
 
     if not found:
         return {"error": f"Approval not found: {interrupt_id}"}
 
-    print(f"[HITL] Rejected: {interrupt_id}")
+    logger.info("Rejected: %s", interrupt_id)
 
     return {
         "status": "rejected",
@@ -339,108 +550,99 @@ def reject_request(session_id: str, payload: dict) -> dict:
 
 def resume_agent_task(session_id: str) -> dict:
     """承認後にエージェントタスクを再開(interruptResponse形式)"""
-    state = session_states.get(session_id)
+    # 確認から "resuming" への遷移までをセッションのロック内で行い、並行したresumeによる二重実行を防ぐ
+    with session_states.lock(session_id):
+        state = session_states.get(session_id)
 
-    if not state:
-        return {"error": f"No session found: {session_id}. Session may have expired or container restarted."}
+        if not state:
+            return {"error": f"No session found: {session_id}. Session may have expired or container restarted."}
 
-    if state.get("status") != "waiting_approval":
-        return {"error": f"Session is not waiting for approval: {state.get('status')}"}
+        if state.get("status") != "waiting_approval":
+            return {"error": f"Session is not waiting for approval: {state.get('status')}"}
 
-    agent = state.get("agent")
-    prev_result = state.get("result")
+        run_state = state.get("run_state")
 
-    if not agent or not prev_result:
-        return {"error": "Invalid session state: agent or result missing"}
+        if not run_state:
+            return {"error": "Invalid session state: run state missing"}
 
-    # 承認レスポンスを構築(interruptResponse形式)
-    responses = []
-    for interrupt in prev_result.interrupts:
-        # メモリから承認状況を取得
-        approval_response = None
-        for approval in pending_approvals.get(session_id, []):
-            if approval["interrupt_id"] == interrupt.id and approval["status"] in ["approved", "rejected"]:
-                approval_response = approval.get("response")
-                break
+        # 承認レスポンスを構築(interruptResponse形式)
+        responses = []
+        for interrupt in state.get("interrupts", []):
+            # メモリから承認状況を取得
+            approval_response = get_approval_response(session_id, interrupt["id"])
 
-        if not approval_response:
-            return {
-                "error": f"Approval not found for interrupt: {interrupt.id}",
-                "interrupt": {"id": interrupt.id, "name": interrupt.name},
-            }
+            if not approval_response:
+                return {
+                    "error": f"Approval not found for interrupt: {interrupt['id']}",
+                    "interrupt": {"id": interrupt["id"], "name": interrupt["name"]},
+                }
 
-        responses.append({
-            "interruptResponse": {
-                "interruptId": interrupt.id,
-                "response": approval_response,
-            }
-        })
+            responses.append({
+                "interruptResponse": {
+                    "interruptId": interrupt["id"],
+                    "response": approval_response,
+                }
+            })
 
-    # 元のタスクIDを取得(新しいタスクは作らない)
-    task_id = state.get("task_id")
-    if not task_id:
-        return {"error": "No task_id found in session state"}
+        # 元のタスクIDを取得(新しいタスクは作らない)
+        task_id = state.get("task_id")
+        if not task_id:
+            return {"error": "No task_id found in session state"}
 
-    # interruptが発生したかどうかを追跡
-    interrupt_occurred = False
+        session_states.set(session_id, {
+            "status": "resuming",
+            "prompt": state.get("prompt"),
+            "task_id": task_id,
+        })
+        _consume_approvals(session_id, [interrupt["id"] for interrupt in state.get("interrupts", [])])
+
+    def run_agent():
+        # 保存した会話状態からエージェントを復元し、interruptResponse形式で再開
+        logger.info("Resuming agent with %s response(s)", len(responses))
+        agent = restore_agent(session_id, run_state)
+        return agent, agent(responses)
 
-    def resume_work():
-        nonlocal interrupt_occurred
+    def record_result(future):
+        # interruptが発生したかどうかを追跡
+        interrupt_occurred = False
         try:
-            # interruptResponse形式でエージェントを再開
-            print(f"[HITL] Resuming agent with {len(responses)} response(s)")
-            result = agent(responses)
+            agent, result = future.result()
 
             if result.stop_reason == "interrupt":
                 # 新しいinterruptが発生
                 interrupt_occurred = True
-                print(f"[HITL] New interrupt occurred, {len(result.interrupts)} approval(s) pending")
-
-                for interrupt in result.interrupts:
-                    pending_approvals.setdefault(session_id, []).append({
-                        "session_id": session_id,
-                        "interrupt_id": interrupt.id,
-                        "name": interrupt.name,
-                        "reason": interrupt.reason,
-                        "status": "pending",
-                        "created_at": datetime.now().isoformat(),
-                    })
-
-                session_states[session_id] = {
-                    "agent": agent,
-                    "result": result,
-                    "status": "waiting_approval",
-                    "prompt": state.get("prompt"),
-                    "task_id": task_id,  # 元のタスクIDを引き継ぐ
-                }
+                logger.info("New interrupt occurred, %s approval(s) pending", len(result.interrupts))
+
+                _add_pending_approvals(session_id, result.interrupts)
+
+                # 元のタスクIDを引き継ぐ
+                session_states.set(session_id, build_waiting_state(state.get("prompt"), task_id, agent, result.interrupts))
 
                 # complete_async_task()を呼ばない
-                print(f"[HITL] Staying HealthyBusy for new interrupt")
+                logger.info("Staying HealthyBusy for new interrupt")
                 return
 
             else:
                 # 正常完了
-                print(f"[HITL] Agent completed: {result.stop_reason}")
-                session_states[session_id] = {
+                logger.info("Agent completed: %s", result.stop_reason)
+                session_states.set(session_id, {
                     "status": "completed",
                     "message": result.message,
-                }
+                })
                 # 承認待ちリストをクリア
-                pending_approvals.pop(session_id, None)
+                _clear_pending_approvals(session_id)
 
         except Exception as e:
-            print(f"[HITL] Resume error: {e}")
-            import traceback
-            traceback.print_exc()
-            session_states[session_id] = {"status": "error", "error": str(e)}
+            logger.exception("Resume error: %s", e)
+            session_states.set(session_id, {"status": "error", "error": str(e)})
+            _clear_pending_approvals(session_id)
 
         finally:
             if not interrupt_occurred:
                 app.complete_async_task(task_id)
-                print(f"[HITL] Completed async task: {task_id}")
+                logger.info("Completed async task: %s", task_id)
 
-    thread = threading.Thread(target=resume_work, daemon=True)
-    thread.start()
+    _submit_agent_work(run_agent, record_result)
 
     return {
         "status": "resuming",
@@ -450,6 +652,22 @@ def resume_agent_task(session_id: str) -> dict:
     }
 
 
+def approve_and_resume(session_id: str, payload: dict) -> dict:
+    """承認を記録し、続けてエージェントを再開(1回の呼び出しで完結させる)"""
+    result = approve_request(session_id, payload)
+    if result.get("status") != "approved":
+        return result
+    return {**result, "resume": resume_agent_task(session_id)}
+
+
+def reject_and_resume(session_id: str, payload: dict) -> dict:
+    """拒否を記録し、続けてエージェントを再開(1回の呼び出しで完結させる)"""
+    result = reject_request(session_id, payload)
+    if result.get("status") != "rejected":
+        return result
+    return {**result, "resume": resume_agent_task(session_id)}
+
+
 def get_result(session_id: str) -> dict:
     """エージェントの実行結果を取得(メモリから)"""
     state = session_states.get(session_id)
@@ -473,7 +691,7 @@ def get_status(session_id: str) -> dict:
         return {
             "session_id": session_id,
             "status": state.get("status"),
-            "has_agent": state.get("agent") is not None,
+            "has_agent": state.get("run_state") is not None,
         }
 
     return {"error": f"Session not found: {session_id}. Session may have expired or container restarted."}
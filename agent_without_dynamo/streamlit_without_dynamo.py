@@ -9,7 +9,9 @@ DynamoDB無しバージョンに対応:
 - AWSモード: boto3 SDKでAgentCore Runtimeを呼び出し
 """
 
+import ast
 import json
+import re
 import streamlit as st
 from datetime import datetime, timezone, timedelta
 
@@ -32,8 +34,9 @@ AGENT_RUNTIME_ARN = "arn:aws:bedrock-agentcore:ap-northeast-1:xxxxxxxxxxxx:runti
 JST = timezone(timedelta(hours=9))
 
 
+@st.cache_data(max_entries=4096, show_spinner=False)
 def utc_to_jst(utc_str: str) -> str:
-    """UTC時間文字列をJST表示用文字列に変換"""
+    """UTC時間文字列をJST表示用文字列に変換（同じ文字列は再実行をまたいでキャッシュ）"""
     if not utc_str:
         return ""
     try:
@@ -51,6 +54,34 @@ def utc_to_jst(utc_str: str) -> str:
 # ========================================
 
 
+# Python repr形式のレスポンスに含まれる Decimal('1.5') を数値リテラルに置換するためのパターン
+_DECIMAL_RE = re.compile(r"Decimal\('([^']*)'\)")
+
+
+@st.cache_resource
+def _agentcore_client(region: str):
+    """AgentCore クライアントを取得（再実行をまたいでリージョンごとに1つを使い回す）"""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "bedrock-agentcore",
+        region_name=region,
+        config=Config(max_pool_connections=32, retries={"max_attempts": 3, "mode": "adaptive"}),
+    )
+
+
+@st.cache_resource
+def _local_session():
+    """ローカルエンドポイント用のHTTPセッション（再実行をまたいでkeep-aliveの接続を使い回す）"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
+    return session
+
+
 def invoke_agentcore(payload: dict, session_id: str = None) -> dict:
     """AgentCoreを呼び出す（モードに応じて切替）"""
     if LOCAL_MODE:
@@ -68,7 +99,7 @@ def invoke_local(payload: dict, session_id: str = None) -> dict:
         if session_id and "session_id" not in payload:
             payload["session_id"] = session_id
 
-        response = requests.post(
+        response = _local_session().post(
             f"{LOCAL_ENDPOINT}/invocations",
             json=payload,
             timeout=120,
@@ -84,14 +115,11 @@ def invoke_local(payload: dict, session_id: str = None) -> dict:
 
 def invoke_runtime(payload: dict, session_id: str = None) -> dict:
     """AWS AgentCore Runtimeを呼び出す（boto3 SDK）"""
-    import boto3
-    from decimal import Decimal
-
     if not AGENT_RUNTIME_ARN:
         return {"error": "AGENT_RUNTIME_ARN が設定されていません"}
 
     try:
-        client = boto3.client("bedrock-agentcore", region_name=AWS_REGION)
+        client = _agentcore_client(AWS_REGION)
 
         kwargs = {
             "agentRuntimeArn": AGENT_RUNTIME_ARN,
@@ -104,45 +132,35 @@ def invoke_runtime(payload: dict, session_id: str = None) -> dict:
         response = client.invoke_agent_runtime(**kwargs)
 
         response_body = response["response"].read()
-        raw_content = response_body.decode("utf-8") if isinstance(response_body, bytes) else str(response_body)
 
-        # デバッグ: raw_contentをログ出力
-        print(f"[DEBUG] raw_content type: {type(raw_content)}")
-        print(f"[DEBUG] raw_content (first 500 chars): {raw_content[:500]}")
-
-        if not raw_content:
+        if not response_body:
             return {"error": "Empty response"}
 
+        # json.loads はbytesをそのまま受け取れるので、成功時はデコードしない
         try:
-            parsed = json.loads(raw_content)
-            print(f"[DEBUG] JSON parsed successfully: {type(parsed)}")
-            return parsed
-        except json.JSONDecodeError as e:
-            print(f"[DEBUG] JSON parse failed: {e}")
+            return json.loads(response_body)
+        except ValueError:
             pass
 
+        # Python literal (Decimal含む) としてパース（フォールバック）
+        raw_content = response_body.decode("utf-8", errors="replace") if isinstance(response_body, bytes) else str(response_body)
+        # Decimal('1.5') は数値リテラルに置換してから評価するため、Decimal型は残らない
         try:
-            result = eval(raw_content, {"Decimal": Decimal, "__builtins__": {}})
-            print(f"[DEBUG] eval parsed successfully: {type(result)}")
-            return _convert_decimals(result)
+            return ast.literal_eval(_DECIMAL_RE.sub(r"\1", raw_content))
         except Exception as e:
-            print(f"[DEBUG] eval failed: {e}")
             return {"error": f"Parse failed: {e}", "raw": raw_content[:500]}
 
     except Exception as e:
         return {"error": str(e)}
 
 
-def _convert_decimals(obj):
-    """Decimal を int/float に変換"""
-    from decimal import Decimal
-    if isinstance(obj, dict):
-        return {k: _convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [_convert_decimals(item) for item in obj]
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    return obj
+@st.cache_data(ttl=5, show_spinner=False)
+def _cached_list_pending(target_session: str, is_local: bool) -> dict:
+    """承認待ち一覧を取得（再実行のたびに呼び出さないよう数秒キャッシュする）"""
+    return invoke_agentcore(
+        {"action": "list_pending"},
+        session_id=target_session if not is_local else None,
+    )
 
 
 # ========================================
@@ -169,6 +187,16 @@ def get_session_options() -> list[tuple[str, str]]:
     return options
 
 
+def show_resume_result(result: dict) -> bool:
+    """approve_and_resume / reject_and_resume の再開結果を表示（再開できた場合True）"""
+    resume = result.get("resume", {})
+    if "error" in resume:
+        st.warning(f"再開エラー: {resume['error']}")
+        return False
+    st.info("エージェントを再開しました")
+    return True
+
+
 # サイドバー
 with st.sidebar:
     st.header("設定")
@@ -203,11 +231,11 @@ with st.sidebar:
     # 最近のセッション一覧
     if st.session_state.sessions:
         st.write("**最近のセッション:**")
-        for i, session in enumerate(reversed(st.session_state.sessions[-5:])):
+        for session in reversed(st.session_state.sessions[-5:]):
             session_id = session["session_id"]
             is_selected = st.session_state.selected_session_id == session_id
             btn_label = f"{'✓ ' if is_selected else ''}{session_id[:8]}..."
-            if st.button(btn_label, key=f"sidebar_session_{i}", use_container_width=True):
+            if st.button(btn_label, key=f"sidebar_session_{session_id}", use_container_width=True):
                 st.session_state.selected_session_id = session_id
                 st.rerun()
 
@@ -227,6 +255,7 @@ with st.sidebar:
 
     st.divider()
     if st.button("🔄 承認待ち一覧を更新"):
+        _cached_list_pending.clear()
         st.rerun()
 
 # タブ
@@ -302,10 +331,7 @@ with tab2:
         pending_result = {"pending_approvals": [], "count": 0}
     else:
         # 承認待ち一覧を取得（AWSモードではsession_idを渡してルーティング）
-        pending_result = invoke_agentcore(
-            {"action": "list_pending"},
-            session_id=target_session if not LOCAL_MODE else None
-        )
+        pending_result = _cached_list_pending(target_session, LOCAL_MODE)
 
     # デバッグ: レスポンスの内容を表示
     with st.expander("🔧 デバッグ: APIレスポンス", expanded=False):
@@ -329,7 +355,7 @@ with tab2:
         else:
             st.write(f"**{len(approvals)} 件の承認待ち**")
 
-            for i, approval in enumerate(approvals):
+            for approval in approvals:
                 created_at_jst = utc_to_jst(approval.get('created_at', ''))
                 with st.expander(
                     f"🔔 {approval.get('name', 'Unknown')} - {created_at_jst}",
@@ -359,77 +385,68 @@ with tab2:
                         session_id = approval.get("session_id")
                         interrupt_id = approval.get("interrupt_id")
 
-                        # 承認ボタン
-                        if st.button("✅ 承認", key=f"approve_{i}", type="primary"):
-                            with st.spinner("承認処理中..."):
+                        # 承認ボタン（承認と再開を1回の呼び出しで行う）
+                        if st.button("✅ 承認", key=f"approve_{interrupt_id}", type="primary"):
+                            with st.spinner("承認してエージェントを再開中..."):
                                 approve_result = invoke_agentcore(
                                     {
-                                        "action": "approve",
+                                        "action": "approve_and_resume",
                                         "session_id": session_id,
                                         "interrupt_id": interrupt_id,
                                         "response": "y",
                                     },
                                     session_id=session_id,  # ★ AWSルーティング用
                                 )
-                            if (
-                                "status" in approve_result
-                                and approve_result["status"] == "approved"
-                            ):
+                            if approve_result.get("status") == "approved":
                                 st.success("承認しました！")
-                                # 自動で再開
-                                with st.spinner("エージェントを再開中..."):
-                                    resume_result = invoke_agentcore(
-                                        {"action": "resume", "session_id": session_id},
-                                        session_id=session_id,
-                                    )
-                                st.info("エージェントを再開しました")
-                                st.rerun()
+                                _cached_list_pending.clear()
+                                # 再開エラーは表示したままにする（再実行すると消えるため）
+                                if show_resume_result(approve_result):
+                                    st.rerun()
                             else:
                                 st.error(f"承認エラー: {approve_result}")
 
                         # 信頼ボタン（今後も自動承認）
-                        if st.button("🔒 信頼", key=f"trust_{i}"):
-                            with st.spinner("信頼処理中..."):
+                        if st.button("🔒 信頼", key=f"trust_{interrupt_id}"):
+                            with st.spinner("信頼してエージェントを再開中..."):
                                 trust_result = invoke_agentcore(
                                     {
-                                        "action": "approve",
+                                        "action": "approve_and_resume",
                                         "session_id": session_id,
                                         "interrupt_id": interrupt_id,
                                         "response": "t",  # trust
                                     },
                                     session_id=session_id,  # ★ AWSルーティング用
                                 )
-                            if "status" in trust_result:
+                            if trust_result.get("status") == "approved":
                                 st.success("このツールを信頼しました！")
-                                # 自動で再開
-                                with st.spinner("エージェントを再開中..."):
-                                    invoke_agentcore(
-                                        {"action": "resume", "session_id": session_id},
-                                        session_id=session_id,
-                                    )
-                                st.rerun()
+                                _cached_list_pending.clear()
+                                # 再開エラーは表示したままにする（再実行すると消えるため）
+                                if show_resume_result(trust_result):
+                                    st.rerun()
+                            else:
+                                st.error(f"承認エラー: {trust_result}")
 
                         # 拒否ボタン
-                        if st.button("❌ 拒否", key=f"reject_{i}"):
-                            with st.spinner("拒否処理中..."):
+                        if st.button("❌ 拒否", key=f"reject_{interrupt_id}"):
+                            with st.spinner("拒否してエージェントを再開中..."):
                                 reject_result = invoke_agentcore(
                                     {
-                                        "action": "reject",
+                                        "action": "reject_and_resume",
                                         "session_id": session_id,
                                         "interrupt_id": interrupt_id,
                                         "reason": "User rejected via UI",
                                     },
                                     session_id=session_id,  # ★ AWSルーティング用
                                 )
-                            if "status" in reject_result:
+                            if reject_result.get("status") == "rejected":
                                 st.warning("拒否しました")
-                                # 自動で再開（拒否結果を反映）
-                                with st.spinner("エージェントを再開中..."):
-                                    invoke_agentcore(
-                                        {"action": "resume", "session_id": session_id},
-                                        session_id=session_id,
-                                    )
-                                st.rerun()
+                                _cached_list_pending.clear()
+                                # 再開エラーは表示したままにする（再実行すると消えるため）
+                                if show_resume_result(reject_result):
+                                    st.rerun()
+                            else:
+                                st.error(f"拒否エラー: {reject_result}")
     else:
         st.warning("予期しないレスポンス:")
         st.json(pending_result)
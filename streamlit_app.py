@@ -5,11 +5,17 @@ Strands Agents HITL + AgentCore Runtime - Streamlit UI
 HITLワークフローを管理するWebインターフェース
 """
 
+import ast
 import json
+import re
+import threading
+import time
+import uuid
 import streamlit as st
 from datetime import datetime, timezone, timedelta
 
 import boto3
+from botocore.config import Config
 
 # ========================================
 # ユーティリティ
@@ -18,13 +24,16 @@ import boto3
 JST = timezone(timedelta(hours=9))
 
 
+@st.cache_data(max_entries=256, show_spinner=False)
 def utc_to_jst(utc_str: str) -> str:
-    """UTC時間文字列をJST表示用文字列に変換"""
+    """UTC時間文字列をJST表示用文字列に変換（同じ文字列は再実行をまたいでキャッシュ）"""
     if not utc_str:
         return ""
+    # 末尾の "Z" のみ fromisoformat が解釈できる形式に置き換える
+    iso_str = utc_str[:-1] + "+00:00" if utc_str.endswith("Z") else utc_str
     try:
         # ISO形式をパース（例: "2026-01-16T03:06:22.129454"）
-        dt = datetime.fromisoformat(utc_str.replace("Z", "+00:00"))
+        dt = datetime.fromisoformat(iso_str)
         # タイムゾーン情報がない場合はUTCとして扱う
         if dt.tzinfo is None:
             dt = dt.replace(tzinfo=timezone.utc)
@@ -40,19 +49,55 @@ def utc_to_jst(utc_str: str) -> str:
 AWS_REGION = "ap-northeast-1"
 AGENT_RUNTIME_ARN = "arn:aws:bedrock-agentcore:ap-northeast-1:xxxxxxxxxxxx:runtime/<agent-id>"
 
+# 接続プールを広げてkeep-aliveを有効にし、一覧取得などが長く止まらないようタイムアウトを短めにする
+AGENTCORE_CONFIG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 3},
+    connect_timeout=3,
+    read_timeout=15,
+)
+
+# 状態を変更するアクションは、タイムアウト後の再送でタスクの二重開始や二重承認にならないよう再試行しない。
+# コールドスタートを待てるよう読み取りタイムアウトも長めにする
+MUTATING_ACTIONS = frozenset({"start", "approve", "reject", "resume", "approve_and_resume"})
+AGENTCORE_MUTATING_CONFIG = Config(
+    max_pool_connections=8,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 1},
+    connect_timeout=3,
+    read_timeout=120,
+)
+
+# 承認待ちの差分取得: 前回見た時刻から少し遡って取り直し（書き込みの遅れ・時計のずれで取りこぼさない）、
+# 一定時間ごとに全件を取り直す
+PENDING_OVERLAP = timedelta(seconds=30)
+PENDING_FULL_RELOAD_SECONDS = 60
+
 # ========================================
 # AgentCore SDK クライアント
 # ========================================
 
-def get_agentcore_client():
-    """AgentCore クライアントを取得"""
-    return boto3.client("bedrock-agentcore", region_name=AWS_REGION)
+@st.cache_resource
+def get_boto_session():
+    """プロセス内で共有するboto3セッションを取得（認証情報の解決とサービス定義の読み込みを再実行ごとに繰り返さない）"""
+    return boto3.Session(region_name=AWS_REGION)
+
+
+@st.cache_resource
+def get_agentcore_client(mutating: bool = False):
+    """AgentCore クライアントを取得（読み取り用・変更用それぞれプロセス内で1つを使い回す）"""
+    config = AGENTCORE_MUTATING_CONFIG if mutating else AGENTCORE_CONFIG
+    return get_boto_session().client("bedrock-agentcore", config=config)
+
+
+# Python repr形式のレスポンスに含まれる Decimal('1.5') を数値リテラルに置換するためのパターン
+_DECIMAL_RE = re.compile(r"Decimal\('([^']*)'\)")
 
 
 def invoke_agentcore(payload: dict, session_id: str = None) -> dict:
     """SDK を使用してエージェントを呼び出す"""
-    from decimal import Decimal
-    client = get_agentcore_client()
+    client = get_agentcore_client(payload.get("action") in MUTATING_ACTIONS)
 
     try:
         kwargs = {
@@ -67,21 +112,21 @@ def invoke_agentcore(payload: dict, session_id: str = None) -> dict:
 
         # ストリームを.read()で読み取る
         response_body = response["response"].read()
-        raw_content = response_body.decode("utf-8") if isinstance(response_body, bytes) else str(response_body)
 
-        if not raw_content:
+        if not response_body:
             return {"error": "Empty response"}
 
-        # JSONパースを試行
+        # JSONパースを試行（json.loads はbytesを直接受け取れるため、成功時は文字列にデコードしない）
         try:
-            return json.loads(raw_content)
-        except json.JSONDecodeError:
+            return json.loads(response_body)
+        except ValueError:
             pass
 
         # Python literal (Decimal含む) としてパース（フォールバック）
+        raw_content = response_body.decode("utf-8", errors="replace") if isinstance(response_body, bytes) else str(response_body)
+        # Decimal('1.5') は数値リテラルに置換してから評価するため、Decimal型は残らない
         try:
-            result = eval(raw_content, {"Decimal": Decimal, "__builtins__": {}})
-            return _convert_decimals(result)
+            return ast.literal_eval(_DECIMAL_RE.sub(r"\1", raw_content))
         except Exception as e:
             return {"error": f"Parse failed: {e}", "raw": raw_content[:500]}
 
@@ -89,16 +134,130 @@ def invoke_agentcore(payload: dict, session_id: str = None) -> dict:
         return {"error": str(e)}
 
 
-def _convert_decimals(obj):
-    """Decimal を int/float に変換"""
-    from decimal import Decimal
-    if isinstance(obj, dict):
-        return {k: _convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [_convert_decimals(item) for item in obj]
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    return obj
+def parse_reason(reason) -> dict:
+    """承認理由（JSON文字列の場合あり）を辞書に変換"""
+    if isinstance(reason, str):
+        try:
+            return json.loads(reason)
+        except json.JSONDecodeError:
+            return {"raw": reason}
+    return reason or {}
+
+
+def normalize_approvals(approvals: list) -> list:
+    """reason をパース済みの承認待ちリストを返す
+
+    パース結果は (session_id, interrupt_id) ごとに session_state に保持し、再実行のたびにパースし直さない。
+    """
+    cache = st.session_state.get("approvals_cache", {})
+    normalized = {}
+    for approval in approvals:
+        key = (approval.get("session_id"), approval.get("interrupt_id"))
+        entry = cache.get(key)
+        if entry is None:
+            entry = {**approval, "reason": parse_reason(approval.get("reason", {}))}
+        normalized[key] = entry
+    # 一覧から消えた承認待ちはキャッシュからも落とす
+    st.session_state.approvals_cache = normalized
+    return list(normalized.values())
+
+
+@st.cache_data
+def _sidebar_text() -> tuple[str, str]:
+    """サイドバーに表示する設定値（定数から組み立てるため一度だけ計算）"""
+    return f"Region: {AWS_REGION}", f"ARN: .../{AGENT_RUNTIME_ARN.split('/')[-1]}"
+
+
+@st.cache_data
+def _session_labels(recent: tuple[tuple[str, str], ...]) -> list[str]:
+    """最近のセッション (session_id, prompt) の選択肢ラベルを作成"""
+    return ["選択してください"] + [f"📝 {session_id[:16]}... ({prompt})" for session_id, prompt in recent]
+
+
+def _warmup(session_id: str):
+    """指定したセッションに ping を送り、そのセッションでのRuntimeのコールドスタートを先に済ませる"""
+    def ping():
+        try:
+            get_agentcore_client().invoke_agent_runtime(
+                agentRuntimeArn=AGENT_RUNTIME_ARN,
+                payload=json.dumps({"action": "ping"}),
+                qualifier="DEFAULT",
+                runtimeSessionId=session_id,
+            )["response"].read()
+        except Exception as e:
+            print(f"[HITL] Warm-up failed: {e}")
+
+    threading.Thread(target=ping, daemon=True).start()
+
+
+def warm_next_session():
+    """プロンプトが編集されたら、次のタスク開始で使うセッションを一度だけ温めておく
+
+    Runtimeはセッションごとに実行環境（課金対象）を割り当てるため、タスクを開始しそうなときだけ、
+    実際に使うセッションIDでウォームアップする
+    """
+    if "next_session_id" not in st.session_state:
+        st.session_state.next_session_id = str(uuid.uuid4())
+        _warmup(st.session_state.next_session_id)
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_pending(nonce: int, since: str = None) -> dict:
+    """承認待ち一覧を取得（nonceを変えるまでは最大10秒キャッシュを返す）
+
+    since を指定するとその時刻以降に作成された承認待ちだけが返る
+    """
+    payload = {"action": "list_pending"}
+    if since:
+        payload["since"] = since
+    return invoke_agentcore(payload)
+
+
+def pending_since():
+    """次回の取得位置（since）を返す。全件を取り直す時はNone"""
+    seen_until = st.session_state.get("pending_seen_until")
+    loaded_at = st.session_state.get("pending_loaded_at")
+    if not seen_until or loaded_at is None or time.monotonic() - loaded_at > PENDING_FULL_RELOAD_SECONDS:
+        return None
+    try:
+        return (datetime.fromisoformat(seen_until) - PENDING_OVERLAP).isoformat()
+    except ValueError:
+        return None
+
+
+def merge_pending(pending_result: dict, full: bool):
+    """取得した承認待ちを手元の一覧にマージし、次回の取得位置（since）を進める
+
+    全件取得なら一覧を置き換える（他の画面で承認・拒否されたものは、定期的な全件取得で消える）
+    """
+    if full:
+        items = {}
+        seen_until = None
+        st.session_state.pending_loaded_at = time.monotonic()
+    else:
+        items = st.session_state.setdefault("pending_items", {})
+        seen_until = st.session_state.get("pending_seen_until")
+    for approval in pending_result.get("pending_approvals", []):
+        items[approval.get("interrupt_id")] = approval
+        created_at = approval.get("created_at")
+        if created_at and (not seen_until or created_at > seen_until):
+            seen_until = created_at
+    st.session_state.pending_items = items
+    st.session_state.pending_seen_until = seen_until
+
+
+def refresh_pending():
+    """次回の描画で承認待ち一覧を全件取り直す"""
+    st.session_state.pending_nonce = st.session_state.get("pending_nonce", 0) + 1
+    st.session_state.resolved_interrupts = set()
+    st.session_state.pending_items = {}
+    st.session_state.pending_seen_until = None
+    st.session_state.pending_loaded_at = None
+
+
+def mark_resolved(interrupt_id: str):
+    """UIで処理済みの承認待ちを、一覧を取り直すまでローカルで非表示にする"""
+    st.session_state.setdefault("resolved_interrupts", set()).add(interrupt_id)
 
 
 # ========================================
@@ -111,10 +270,12 @@ st.title("🤖 Human in the Loop - 承認ダッシュボード")
 # サイドバー
 with st.sidebar:
     st.header("エージェント設定")
-    st.text(f"Region: {AWS_REGION}")
-    st.text(f"ARN: .../{AGENT_RUNTIME_ARN.split('/')[-1]}")
+    region_text, arn_text = _sidebar_text()
+    st.text(region_text)
+    st.text(arn_text)
 
     if st.button("🔄 承認待ち一覧を更新"):
+        refresh_pending()
         st.rerun()
 
 # タブ
@@ -127,12 +288,14 @@ with tab1:
     st.header("新しいタスクを開始")
 
     prompt = st.text_area(
-        "プロンプト", value="Please delete the file /tmp/test.txt", height=100
+        "プロンプト", value="Please delete the file /tmp/test.txt", height=100, on_change=warm_next_session
     )
 
     if st.button("▶️ タスク開始", type="primary"):
         with st.spinner("タスクを開始中..."):
-            result = invoke_agentcore({"action": "start", "prompt": prompt})
+            # 温めておいたセッションがあれば使う（使ったセッションIDは再利用しない）
+            session_id = st.session_state.pop("next_session_id", None) or str(uuid.uuid4())
+            result = invoke_agentcore({"action": "start", "prompt": prompt}, session_id=session_id)
 
         if "error" in result:
             st.error(f"エラー: {result['error']}")
@@ -159,8 +322,9 @@ with tab1:
 with tab2:
     st.header("承認待ちリクエスト")
 
-    # 承認待ち一覧を取得
-    pending_result = invoke_agentcore({"action": "list_pending"})
+    # 承認待ち一覧を取得（2回目以降は前回までに見た時刻以降の差分だけ。一定時間ごとに全件）
+    since = pending_since()
+    pending_result = fetch_pending(st.session_state.get("pending_nonce", 0), since)
 
     # 結果が辞書でない場合はエラー表示
     if not isinstance(pending_result, dict):
@@ -171,19 +335,49 @@ with tab2:
         if "traceback" in pending_result:
             st.code(pending_result["traceback"])
     elif "pending_approvals" in pending_result:
-        approvals = pending_result["pending_approvals"]
+        merge_pending(pending_result, full=since is None)
+
+        # このUIで処理済みのものは一覧を取り直さずに除外する
+        resolved = st.session_state.get("resolved_interrupts", set())
+        approvals = [a for a in st.session_state.pending_items.values() if a.get("interrupt_id") not in resolved]
 
         if not approvals:
             st.info("承認待ちのリクエストはありません")
         else:
             st.write(f"**{len(approvals)} 件の承認待ち**")
 
-            for i, approval in enumerate(approvals):
-                created_at_jst = utc_to_jst(approval.get('created_at', ''))
-                with st.expander(
-                    f"🔔 {approval.get('name', 'Unknown')} - {created_at_jst}",
-                    expanded=True,
-                ):
+            # 表示前に理由のパースを済ませ（パース済みのものは再利用）、描画ではUIの組み立てだけを行う
+            approvals = normalize_approvals(approvals)
+
+            # 一覧は1つの表で表示し、操作ボタンは選択した行の分だけ作る
+            table = st.dataframe(
+                [
+                    {
+                        "ツール": approval["reason"].get("tool", "N/A"),
+                        "名前": approval.get("name", "Unknown"),
+                        "セッションID": approval.get("session_id", "N/A")[:12],
+                        "作成日時": utc_to_jst(approval.get("created_at", "")),
+                    }
+                    for approval in approvals
+                ],
+                on_select="rerun",
+                selection_mode="single-row",
+                hide_index=True,
+                use_container_width=True,
+                # 表示する承認待ちが変わったら選択をリセット（行番号がずれて別の承認待ちを選ばないように）
+                key=f"pending_table_{hash(tuple(a.get('interrupt_id') for a in approvals))}",
+            )
+
+            selected_rows = [row for row in table.selection.rows if row < len(approvals)]
+            if not selected_rows:
+                st.caption("行を選択すると詳細と操作ボタンが表示されます")
+            else:
+                approval = approvals[selected_rows[0]]
+                reason = approval["reason"]
+                # 操作結果はこの枠だけを差し替えて表示する（一覧全体を再描画しない）
+                slot = st.empty()
+                outcome = None
+                with slot.container(border=True):
                     col1, col2 = st.columns([3, 1])
 
                     with col1:
@@ -192,48 +386,39 @@ with tab2:
                             "**Interrupt ID:**", approval.get("interrupt_id", "N/A")
                         )
 
-                        reason = approval.get("reason", {})
-                        if isinstance(reason, str):
-                            reason = json.loads(reason)
-
                         st.write("**ツール:**", reason.get("tool", "N/A"))
-                        st.write("**入力パラメータ:**")
-                        st.json(reason.get("input", {}))
+                        # 入力パラメータは開いたときだけ表示する
+                        with st.expander("入力パラメータ", expanded=False):
+                            st.json(reason.get("input", {}))
                         st.write("**メッセージ:**", reason.get("message", "N/A"))
 
                     with col2:
                         session_id = approval.get("session_id")
                         interrupt_id = approval.get("interrupt_id")
 
-                        # 承認ボタン
-                        if st.button("✅ 承認", key=f"approve_{i}", type="primary"):
-                            with st.spinner("承認処理中..."):
+                        # 承認ボタン（承認と再開を1回の呼び出しで行う）
+                        if st.button("✅ 承認", key=f"approve_{interrupt_id}", type="primary"):
+                            with st.spinner("承認してエージェントを再開中..."):
                                 approve_result = invoke_agentcore(
                                     {
-                                        "action": "approve",
+                                        "action": "approve_and_resume",
                                         "session_id": session_id,
                                         "interrupt_id": interrupt_id,
                                         "response": "y",
-                                    }
+                                    },
+                                    session_id=session_id,
                                 )
-                            if (
-                                "status" in approve_result
-                                and approve_result["status"] == "approved"
-                            ):
-                                st.success("承認しました！")
-                                # 自動で再開
-                                with st.spinner("エージェントを再開中..."):
-                                    resume_result = invoke_agentcore(
-                                        {"action": "resume", "session_id": session_id},
-                                        session_id=session_id,
-                                    )
-                                st.info("エージェントを再開しました")
-                                st.rerun()
+                            if approve_result.get("status") == "approved":
+                                mark_resolved(interrupt_id)
+                                if "error" in approve_result.get("resume", {}):
+                                    outcome = (slot.warning, f"承認しました（再開エラー: {approve_result['resume']['error']}）")
+                                else:
+                                    outcome = (slot.success, "承認しました！エージェントを再開しました")
                             else:
                                 st.error(f"承認エラー: {approve_result}")
 
                         # 信頼ボタン（今後も自動承認）
-                        if st.button("🔒 信頼", key=f"trust_{i}"):
+                        if st.button("🔒 信頼", key=f"trust_{interrupt_id}"):
                             with st.spinner("信頼処理中..."):
                                 trust_result = invoke_agentcore(
                                     {
@@ -244,11 +429,11 @@ with tab2:
                                     }
                                 )
                             if "status" in trust_result:
-                                st.success("このツールを信頼しました！")
-                                st.rerun()
+                                mark_resolved(interrupt_id)
+                                outcome = (slot.success, "このツールを信頼しました！")
 
                         # 拒否ボタン
-                        if st.button("❌ 拒否", key=f"reject_{i}"):
+                        if st.button("❌ 拒否", key=f"reject_{interrupt_id}"):
                             with st.spinner("拒否処理中..."):
                                 reject_result = invoke_agentcore(
                                     {
@@ -259,8 +444,12 @@ with tab2:
                                     }
                                 )
                             if "status" in reject_result:
-                                st.warning("拒否しました")
-                                st.rerun()
+                                mark_resolved(interrupt_id)
+                                outcome = (slot.warning, "拒否しました")
+
+                if outcome:
+                    show, message = outcome
+                    show(message)
     else:
         st.warning("予期しないレスポンス:")
         st.json(pending_result)
@@ -274,15 +463,18 @@ with tab3:
     # セッションID入力
     session_id_input = st.text_input("セッションID", placeholder="abc123-...")
 
-    # 保存されたセッション一覧
+    # 保存されたセッション一覧（ボタンを並べず1つのselectboxで選択）
     if "sessions" in st.session_state and st.session_state.sessions:
-        st.write("**最近のセッション:**")
-        for session in reversed(st.session_state.sessions[-5:]):
-            if st.button(
-                f"📝 {session['session_id'][:16]}... ({session['prompt']})",
-                key=f"session_{session['session_id']}",
-            ):
-                session_id_input = session["session_id"]
+        recent_sessions = list(reversed(st.session_state.sessions[-5:]))
+        labels = _session_labels(tuple((s["session_id"], s["prompt"]) for s in recent_sessions))
+        selected_idx = st.selectbox(
+            "最近のセッション",
+            range(len(labels)),
+            format_func=labels.__getitem__,
+            key="result_session_select",
+        )
+        if selected_idx > 0:
+            session_id_input = recent_sessions[selected_idx - 1]["session_id"]
 
     if st.button("🔍 結果を取得") and session_id_input:
         with st.spinner("結果を取得中..."):